@@ -0,0 +1,169 @@
+import csv
+import json
+import time
+from collections import deque
+from contextlib import nullcontext
+
+from PySide6.QtCore import Qt, QPointF, QRectF
+from PySide6.QtGui import QColor, QPen
+
+HISTORY_FRAMES = 240  # Сколько последних кадров держать для гистограммы и выгрузки
+HISTOGRAM_MS = (2, 4, 8, 16, 33, 66, 133)  # Верхние границы корзин гистограммы времени кадра
+OVERLAY_WIDTH = 220
+
+_DISABLED = nullcontext()  # Один общий пустой контекст: выключенный профайлер ничего не создаёт
+
+
+class _Phase:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        phases = self.profiler._phases
+        phases[self.name] = phases.get(self.name, 0.0) + time.perf_counter() - self.start
+
+
+class _Frame:
+    __slots__ = ("profiler", "start")
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def __enter__(self):
+        self.profiler._phases = {}
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profiler._finish(time.perf_counter() - self.start)
+
+
+class FrameProfiler:
+    """Время этапов отрисовки, счётчики и скользящая история кадров; выключенный почти ничего не стоит"""
+
+    def __init__(self, history=HISTORY_FRAMES):
+        self.enabled = False
+        self.overlay = False  # Рисовать ли сводку поверх виджета
+        self.frames = deque(maxlen=history)  # {"total": сек, "phases": {...}, "counters": {...}}
+        self.errors = 0
+        self.last_error = None
+        self._phases = {}
+        self._counters = {}
+
+    def setEnabled(self, enabled, overlay=None):
+        self.enabled = enabled
+        self.overlay = enabled if overlay is None else overlay
+
+    def frame(self):
+        return _Frame(self) if self.enabled else _DISABLED
+
+    def phase(self, name):
+        return _Phase(self, name) if self.enabled else _DISABLED
+
+    def count(self, name, n=1):
+        # Счётчики копятся между кадрами (например, вычисления в фоне) и приписываются следующему кадру
+        if self.enabled:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def error(self, error):
+        # Ошибки считаются всегда: это редкое событие, а не горячий путь
+        self.errors += 1
+        self.last_error = f"{type(error).__name__}: {error}"
+
+    def _finish(self, total):
+        self.frames.append({"total": total, "phases": self._phases, "counters": self._counters})
+        self._phases = {}
+        self._counters = {}
+
+    def reset(self):
+        self.frames.clear()
+        self._phases = {}
+        self._counters = {}
+
+    def histogram(self):
+        """Число кадров в корзинах HISTOGRAM_MS (последняя корзина - всё, что дольше)"""
+        counts = [0] * (len(HISTOGRAM_MS) + 1)
+        for frame in self.frames:
+            ms = frame["total"] * 1000
+            bucket = 0
+            while bucket < len(HISTOGRAM_MS) and ms > HISTOGRAM_MS[bucket]:
+                bucket += 1
+            counts[bucket] += 1
+        return counts
+
+    def summary(self):
+        """Средние по истории: время кадра, этапов и счётчики на кадр"""
+        count = len(self.frames)
+        if not count:
+            return {"frames": 0}
+        phases = {}
+        counters = {}
+        for frame in self.frames:
+            for name, seconds in frame["phases"].items():
+                phases[name] = phases.get(name, 0.0) + seconds
+            for name, value in frame["counters"].items():
+                counters[name] = counters.get(name, 0) + value
+        total = sum(frame["total"] for frame in self.frames)
+        return {"frames": count,
+                "mean_ms": total / count * 1000,
+                "max_ms": max(frame["total"] for frame in self.frames) * 1000,
+                "phases_ms": {name: seconds / count * 1000 for name, seconds in phases.items()},
+                "counters": {name: value / count for name, value in counters.items()},
+                "histogram": dict(zip([f"<={ms}" for ms in HISTOGRAM_MS] + [f">{HISTOGRAM_MS[-1]}"],
+                                      self.histogram())),
+                "errors": self.errors}
+
+    def dump_json(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"summary": self.summary(), "frames": list(self.frames)}, file, ensure_ascii=False, indent=1)
+
+    def dump_csv(self, path):
+        # Один кадр - одна строка; времена в миллисекундах
+        phases = sorted({name for frame in self.frames for name in frame["phases"]})
+        counters = sorted({name for frame in self.frames for name in frame["counters"]})
+        with open(path, "w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(["frame", "total_ms"] + [f"{name}_ms" for name in phases] + counters)
+            for i, frame in enumerate(self.frames):
+                writer.writerow([i, frame["total"] * 1000]
+                                + [frame["phases"].get(name, 0.0) * 1000 for name in phases]
+                                + [frame["counters"].get(name, 0) for name in counters])
+
+    def draw_overlay(self, painter, left=0, top=0):
+        """Полупрозрачная сводка последнего кадра и полоски времени недавних кадров; возвращает её QRectF"""
+        if not (self.enabled and self.overlay and self.frames):
+            return None
+        last = self.frames[-1]
+        lines = [f"кадр {last['total'] * 1000:.2f} мс"]
+        lines += [f"{name} {seconds * 1000:.2f} мс" for name, seconds in last["phases"].items()]
+        lines += [f"{name} {value}" for name, value in last["counters"].items()]
+        if self.last_error:
+            lines.append(f"ошибок {self.errors}: {self.last_error}")
+
+        painter.save()
+        line_height = painter.fontMetrics().height()
+        bars_height = 40
+        height = line_height * len(lines) + bars_height + 12
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(0, 0, 0, 160))
+        painter.drawRect(QRectF(left, top, OVERLAY_WIDTH, height))
+
+        painter.setPen(QPen(Qt.white))
+        for i, line in enumerate(lines):
+            painter.drawText(QPointF(left + 6, top + 4 + line_height * (i + 1) - painter.fontMetrics().descent()), line)
+
+        # Полоска на кадр; высота 33 мс - вся полоса, красным кадры дольше 16 мс
+        base = top + height - 4
+        bar = OVERLAY_WIDTH / self.frames.maxlen
+        for i, frame in enumerate(self.frames):
+            ms = frame["total"] * 1000
+            painter.fillRect(QRectF(left + i * bar, base - min(ms / 33, 1) * bars_height, max(bar, 1),
+                                    min(ms / 33, 1) * bars_height),
+                             QColor(Qt.red) if ms > 16 else QColor(Qt.green))
+        painter.restore()
+        return QRectF(left, top, OVERLAY_WIDTH, height)
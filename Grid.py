@@ -1,7 +1,23 @@
 from PySide6.QtWidgets import QWidget
-from PySide6.QtGui import QPainter, QPen, QColor, QBrush, QPolygon
-from PySide6.QtCore import Qt, QRect, Signal, QPoint, QSize
+from PySide6.QtGui import QPainter, QPainterPath, QPixmap, QPen, QColor, QBrush, QPolygon
+from PySide6.QtCore import Qt, QRectF, Signal, QPoint, QSize, QFileSystemWatcher, QTimer
+import logging
 import math
+import os
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from FrameProfiler import FrameProfiler
+from GridIO import load_points
+from GridParser import parse_points
+from GridSandbox import SandboxError
+from GridSeries import registry
+from GridStore import ResultStore
+from GridEval import np, evaluate_program, calculate_matrix, changed_range, EvaluationJob, \
+    mark_failed, is_failed, clear_failed, build_lod_pyramid, merge_columns, refine_samples, FrameScheduler, \
+    uses_time
+
+
+logger = logging.getLogger(__name__)
 
 
 def format_value(val):
@@ -13,137 +29,457 @@ def format_value(val):
     return formatted
 
 
+def make_function(expr, color, name=None):
+    # Одинаковые (выражение, цвет, имя) дают одну и ту же серию из реестра
+    return registry.get(expr, color, name)
+
+
+# Файл с описаниями функций
+FUNCTIONS_FILE = "Функции.txt"
+# Пауза после последнего изменения файла функций перед перечитыванием, мс
+RELOAD_DEBOUNCE_MS = 200
+# Частота анимации функций от времени t по умолчанию
+ANIMATION_FPS = 30
+
+# Предельный размер виджета в Qt
+QWIDGETSIZE_MAX = (1 << 24) - 1
+
+# Ниже этого шага между точками объёмные столбики не помещаются и включается LOD
+LOD_SPACING = 40
+# Минимальная ширина корзины LOD в пикселях
+LOD_BIN_PX = 2
+# Шире этого статический слой сетки кэшируется кусками: ось слева, повторяющийся кусок и правый край
+BACKGROUND_CACHE_MAX_WIDTH = 8192
+# Период штриха DashLine пером толщиной 1 (4 + 2 пикселя); куски сетки выравниваются по нему
+DASH_PERIOD = 6
+# Ширина повторяющегося куска сетки, кратна DASH_PERIOD
+BACKGROUND_TILE = 200 * DASH_PERIOD
+# Минимальное расстояние между делениями по Y в пикселях
+MIN_TICK_PX = 12
+# Минимальный зазор между подписями по X в пикселях
+LABEL_GAP = 8
+
+
+def tick_step(step, px_per_unit, min_px=None):
+    # Запрошенный шаг, умноженный на 1, 2, 5, 10, 20, 50... пока деления не станут реже min_px пикселей
+    min_px = MIN_TICK_PX if min_px is None else min_px
+    if px_per_unit <= 0:
+        return step
+    factor = 1
+    multipliers = (2, 2.5, 2)
+    i = 0
+    while step * factor * px_per_unit < min_px:
+        factor *= multipliers[i % 3]
+        i += 1
+    return step * factor
+
+
+@lru_cache(maxsize=64)
+def y_ticks(zero_y, top, bottom, px_per_unit, step, above, below):
+    # Положения и подписи делений по Y (выше и ниже нуля) и диагоналей к ним; кэшируются по параметрам
+    lines = []
+    diagonals = []
+    if above:
+        y = zero_y
+        k = 0
+        while y >= top:
+            lines.append((y, format_value(k * step)))
+            k += 1
+            y = zero_y - k * px_per_unit * step
+            diagonals.append(y)
+    if below:
+        k = 1
+        while True:
+            y = zero_y + k * px_per_unit * step
+            if y > bottom:
+                break
+            lines.append((y, format_value(-k * step)))
+            k += 1
+            diagonals.append(y)
+    return lines, diagonals
+
+
+def add_polygon(path, points):
+    path.moveTo(*points[0])
+    for point in points[1:]:
+        path.lineTo(*point)
+    path.closeSubpath()
+
+
+def default_functions():
+    return [
+        make_function("4/(1-x)", QColor(Qt.red)),
+        make_function("x**2", QColor(Qt.green)),
+        make_function("5*math.sin(x)", QColor(Qt.blue)),
+        make_function("math.log(abs(x)+1)", QColor(Qt.magenta))
+    ]
+
+
+def read_function_parts(file, chunk_size=65536):
+    # Читает файл функций кусками и отдаёт записи между запятыми, не держа весь файл в памяти
+    tail = ""
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        parts = (tail + chunk).split(',')
+        tail = parts.pop()
+        for part in parts:
+            part = part.strip()
+            if part:
+                yield part
+    tail = tail.strip()
+    if tail:
+        yield tail
+
+
 class Grid(QWidget):
     pointsProcessed = Signal()
+    resultsChanged = Signal(int, int, int)  # Точки [start, old_end) заменены на [start, new_end); -1 - всё
+    _evaluated = Signal(object)  # Готовая фоновая задача, доставляется в GUI-поток
+    animationFps = Signal(float, float)  # Достигнутая и целевая частота кадров анимации
 
     def __init__(self):
         super().__init__()
         self.countOfDiagrams = 3
-        self.functions = self.getFuncs()
+        self.functions_path = FUNCTIONS_FILE
+        self.functions = self.getFuncs(self.functions_path)
         self.points = [1, 2, 3]
+        self._base_points = self.points  # Точки пользователя до адаптивного уточнения
+        self.adaptive = False
         self.stepY = 1
         self.border_left = 90
         self.border_right = 60
         self.padding_top = 20
         self.padding_bottom = 40
-        self.point_spacing = 60
+        self.point_spacing = 60  # Фактический шаг между точками; меньше заданного, если иначе график не влезет в Qt
+        self._spacing = self.point_spacing  # Шаг, заданный пользователем
         self.perspective_depth = 10
+        self.vectorized = np is not None  # Вычислять функции через NumPy сразу по всем точкам
+        # Кэш результатов и границ: пересчитывается только при смене точек или функций
+        self._results = None  # ResultStore: значения по функциям, маска и суммы стопок в каждой точке
+        self._bounds = None
+        self._lod = None  # Пирамида сводок для LOD, строится по требованию
+        self._background = None  # Кэш статического слоя сетки: [(x, картинка)], рисуются поверх повторяющегося куска
+        self._background_tile = None  # (x, картинка) повторяющегося по X куска сетки для широкого графика
+        self._background_key = None
+        self._sandbox = None
+        self._executor = None  # Пул фоновых вычислений, включается через setAsync
+        self._job = None
+        self._evaluated.connect(self._applyEvaluation)
+        self._watcher = None  # Слежение за файлом функций, включается через watchFunctionsFile
+        self._reload_timer = None
+        self.time = 0.0  # Значение t в выражениях; меняется анимацией
+        self._animation = None  # FrameScheduler, включается через setAnimated
+        self._animation_timer = None
+        self.profiler = FrameProfiler()  # Время этапов отрисовки, включается через profiler.setEnabled
+
+    @staticmethod
+    def getFuncs(path=FUNCTIONS_FILE):
+        try:
+            with open(path, "r") as file:
+                return Grid.parseFuncs(file)
+        except (FileNotFoundError, IOError):
+            return default_functions()
 
     @staticmethod
-    def getFuncs():
+    def parseFuncs(file, fallback=True):
+        # Функции из файла или io.StringIO в формате "выражение цвет, выражение цвет";
+        # если ни одной корректной нет - функции по умолчанию, а при fallback=False пустой список
         color_map = {'red': Qt.red, 'green': Qt.green, 'blue': Qt.blue, 'cyan': Qt.cyan, 'magenta': Qt.magenta,
                      'yellow': Qt.yellow, 'darkRed': Qt.darkRed, 'darkGreen': Qt.darkGreen, 'darkBlue': Qt.darkBlue,
                      'darkCyan': Qt.darkCyan, 'darkMagenta': Qt.darkMagenta, 'darkYellow': Qt.darkYellow,
                      'gray': Qt.gray, 'darkGray': Qt.darkGray, 'lightGray': Qt.lightGray, 'black': Qt.black,
                      'white': Qt.white, 'transparent': Qt.transparent}
         functions = []
-        try:
-            with open("Функции.txt", "r") as file:
-                content = file.read().strip()
-                if not content:
-                    return [
-                        {"func": "4/(1-x)", "color": QColor(Qt.red)},
-                        {"func": "x**2", "color": QColor(Qt.green)},
-                        {"func": "5*math.sin(x)", "color": QColor(Qt.blue)},
-                        {"func": "math.log(abs(x)+1)", "color": QColor(Qt.magenta)}
-                    ]
-
-                for func_part in content.split(','):
-                    func_part = func_part.strip()
-                    if not func_part:
-                        continue
-
-                    parts = func_part.rsplit(' ', 1)
-                    if len(parts) != 2:
-                        continue
-
-                    func_expr, color_name = parts
-
-                    if color_name not in color_map:
-                        continue
-
-                    if 'x' not in func_expr:
-                        continue
-
-                    functions.append({
-                        "func": func_expr.strip(),
-                        "color": QColor(color_map[color_name])
-                    })
-
-                if not functions:
-                    return [
-                        {"func": "4/(1-x)", "color": QColor(Qt.red)},
-                        {"func": "x**2", "color": QColor(Qt.green)},
-                        {"func": "5*math.sin(x)", "color": QColor(Qt.blue)},
-                        {"func": "math.log(abs(x)+1)", "color": QColor(Qt.magenta)}
-                    ]
-
-                return functions
+        for func_part in read_function_parts(file):
+            parts = func_part.rsplit(' ', 1)
+            if len(parts) != 2:
+                continue
 
-        except (FileNotFoundError, IOError):
-            return [
-                {"func": "4/(1-x)", "color": QColor(Qt.red)},
-                {"func": "x**2", "color": QColor(Qt.green)},
-                {"func": "5*math.sin(x)", "color": QColor(Qt.blue)},
-                {"func": "math.log(abs(x)+1)", "color": QColor(Qt.magenta)}
-            ]
+            func_expr, color_name = parts
 
-    def setPoints(self, points_str):
-        points = []
-        for p in points_str.split(','):
-            p = p.strip()
-            if not p:
+            if color_name not in color_map:
                 continue
-            try:
-                p = p.replace('pi', str(math.pi)).replace('e', str(math.e))
-                points.append(float(eval(p)))
-            except:
+
+            if 'x' not in func_expr and 't' not in func_expr:
                 continue
-        self.points = points if points else [1, 2, 3]
-        self.updateGeometry()  # Обновляем геометрию при изменении точек
-        self.pointsProcessed.emit()
-        self.update()
+
+            functions.append(make_function(func_expr.strip(), QColor(color_map[color_name])))
+
+        if not functions and fallback:
+            return default_functions()
+
+        return functions
+
+    def setPoints(self, points_str):
+        # Токены разбираются без eval, значения кэшируются по тексту токена
+        # Диапазоны вида 0:100:0.5 и linspace(-pi, pi, 10000) сразу дают массив float64, без списка чисел
+        self.setPointValues(parse_points(points_str))
+
+    def loadPoints(self, path):
+        # Точки из CSV, .npy или сырого float64 файла, без разбора строки через поле ввода
+        self.setPointValues(load_points(path))
+
+    def setPointValues(self, points):
+        # Уже готовые значения точек: список, array('d') или массив NumPy
+        self._base_points = points if len(points) else [1, 2, 3]
+        self.scheduleEvaluation(self._base_points, self._pending()[1])
+
+    def setAdaptive(self, enabled):
+        # Добавлять точки там, где соседние значения функций резко различаются (например, у полюса)
+        self.adaptive = enabled
+        self.scheduleEvaluation(self._base_points, self._pending()[1])
 
     def setYStep(self, step):
         try:
             step = float(step)
             self.stepY = max(0.01, step)
-            self.update()
         except:
             self.stepY = 1
-            self.update()
-
-    def calculate_functions(self):
-        results = []
-        for point in self.points:
-            point_results = []
-            for func in self.functions:
-                try:
-                    y = eval(func["func"], {'math': math, 'x': point})
-                    point_results.append(y if y is not None and not math.isnan(y) else None)
-                except:
-                    point_results.append(None)
-            results.append(point_results)
-        return results
+        self._bounds = None  # Границы округляются по шагу, результаты остаются прежними
+        self.update()
+
+    def setSandbox(self, sandbox):
+        # Выражения вычисляются в отдельном процессе с ограничением времени и памяти
+        if self._sandbox is not None:
+            self._sandbox.close()
+        self._sandbox = sandbox
+        self.invalidateResults()
+        self.update()
+
+    def _sandboxResults(self, functions, points, t):
+        # Весь набор - один вызов песочницы; если он не уложился в бюджет, виноватые выражения ищутся по одному
+        exprs = [func.func for func in functions]
+        live = [expr for expr in dict.fromkeys(exprs) if not is_failed(expr)]
+        stores = {}
+        batch = self._sandboxCall(live, points, t) if live else None
+        if batch is not None and live == exprs:
+            return batch
+        if batch is not None:
+            stores = {expr: (batch, j) for j, expr in enumerate(live)}
+        elif len(live) > 1:
+            for expr in live:
+                store = self._sandboxCall([expr], points, t)
+                if store is not None:
+                    stores[expr] = (store, 0)
+        missing = ResultStore.empty(1, len(points))
+        return ResultStore.stack([stores.get(expr, (missing, 0)) for expr in exprs], len(points))
+
+    def _sandboxCall(self, exprs, points, t):
+        try:
+            store = self._sandbox.evaluate(exprs, points, t)
+        except SandboxError:
+            # Сбой песочницы, а не выражений: в чёрный список не заносим, попробуем при следующем вычислении
+            logger.exception("Ошибка песочницы при вычислении %s", ", ".join(exprs))
+            return ResultStore.empty(len(exprs), len(points))
+        if store is None and len(exprs) == 1:
+            mark_failed(exprs[0])  # Превысило бюджет времени или памяти: не пытаемся снова на каждом кадре
+        return store
+
+    def setAsync(self, enabled):
+        if enabled and self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="grid-eval")
+        elif not enabled and self._executor is not None:
+            if self._job is not None:
+                self._job.cancel()
+                self._job = None
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _pending(self):
+        # Точки и функции, которые будут показаны после завершения текущей задачи
+        if self._job is not None:
+            return self._job.points, self._job.functions
+        return self.points, self.functions
+
+    def scheduleEvaluation(self, points, functions):
+        # Без пула задача выполняется сразу; с пулом, пока она считается, отрисовывается
+        # последний готовый результат, а устаревшая задача отменяется
+        if self._job is not None:
+            self._job.cancel()
+        job = self._makeJob(points, functions)
+        self._job = job
+        if self._executor is None:
+            job.run()
+            self._applyEvaluation(job)
+            return
+        job.future = self._executor.submit(job.run)
+        job.future.add_done_callback(lambda future: self._evaluated.emit(job))
+
+    def _makeJob(self, points, functions):
+        if self.adaptive:
+            # Уточнение меняет сам набор точек, поэтому считаем всё от исходных точек пользователя
+            calculate = lambda pts: self.calculate_functions(pts, functions)
+            job = EvaluationJob(self._base_points, functions, 0, len(self.points), len(self._base_points),
+                                calculate, "full")
+            job.refine = lambda pts, rows: refine_samples(pts, rows, calculate)
+            return job
+        if self._results is None:
+            if self._executor is not None:
+                # Переиспользовать нечего: считаем всё в фоне, а не в paintEvent
+                return EvaluationJob(points, functions, 0, len(self.points), len(points),
+                                     lambda pts: self.calculate_functions(pts, functions), "full")
+            # Без пула результаты посчитаются при отрисовке
+            return EvaluationJob(points, functions, 0, 0, 0, None, "lazy")
+        if functions is self.functions:
+            # Пересчитываем только вставленные или изменённые точки
+            start, old_end, new_end = changed_range(self.points, points)
+            return EvaluationJob(points, functions, start, old_end, new_end,
+                                 lambda pts: self.calculate_functions(pts, functions), "rows")
+        if points is self.points:
+            # Считаем только новые функции, столбцы прежних берём из кэша
+            known = {id(func) for func in self.functions}
+            added = [func for func in functions if id(func) not in known]
+            job = EvaluationJob(points, functions, 0, len(points), len(points),
+                                lambda pts: self.calculate_functions(pts, added), "columns")
+            job.added = added
+            return job
+        return EvaluationJob(points, functions, 0, len(self.points), len(points),
+                             lambda pts: self.calculate_functions(pts, functions), "full")
+
+    def _applyEvaluation(self, job):
+        if job is not self._job:
+            return
+        self._job = None
+        if job.rows is None:
+            # Задача упала: показываем пустые результаты, а не перезапускаем её на каждой отрисовке
+            if job.future is not None and job.future.exception() is not None:
+                logger.error("Ошибка фонового вычисления", exc_info=job.future.exception())
+            job.rows = ResultStore.empty(len(job.functions), len(job.points))
+            job.mode = "full"
+            job.start, job.old_end, job.new_end = 0, len(self.points), len(job.points)
+        if job.mode == "rows":
+            self._results = self._results.splice(job.start, job.old_end, job.rows)
+        elif job.mode == "columns":
+            self._results = merge_columns(self._results, self.functions, job.functions, job.added, job.rows)
+        elif job.mode == "full":
+            self._results = job.rows
+        else:
+            self._results = None
+        self.points = job.points
+        self.functions = job.functions
+        self._fitSpacing()
+        if self._animation is not None:
+            self._animation.reset(self._frameCalculator())
+        self._resultsChanged()
+        if job.mode == "rows":
+            self.resultsChanged.emit(job.start, job.old_end, job.new_end)
+        else:
+            self.resultsChanged.emit(-1, -1, -1)
+        self.updateGeometry()  # Обновляем геометрию при изменении точек
+        self.pointsProcessed.emit()
+        self.update()
+
+    def setAnimated(self, enabled, fps=ANIMATION_FPS):
+        # Кадры f(x, t) считаются наперёд в потоке планировщика, таймер только показывает готовые
+        if self._animation is not None:
+            self._animation.stop()
+            self._animation = None
+            self._animation_timer.stop()
+        if not enabled:
+            return
+        self._animation = FrameScheduler(self._frameCalculator(), fps)
+        if self._animation_timer is None:
+            self._animation_timer = QTimer(self)
+            self._animation_timer.setTimerType(Qt.PreciseTimer)
+            self._animation_timer.timeout.connect(self._animationTick)
+        self._animation_timer.start(max(1, round(1000 / fps)))
+        self._animation.start()
+
+    def _frameCalculator(self):
+        # На каждом кадре пересчитываются только функции от t, столбцы остальных считаются один раз
+        points, functions = self.points, self.functions
+        animated = [func for func in functions if uses_time(func.func)]
+        still = [func for func in functions if not uses_time(func.func)]
+        still_results = None
+
+        def calculate(t):
+            nonlocal still_results
+            if still and still_results is None:
+                still_results = self.calculate_functions(points, still, t)
+            if not still:
+                results = self.calculate_functions(points, functions, t)
+            elif not animated:
+                results = still_results
+            else:
+                results = merge_columns(still_results, still, functions, animated,
+                                        self.calculate_functions(points, animated, t))
+            # Пирамиду LOD тоже строим в потоке планировщика, чтобы кадр в GUI-потоке только рисовался
+            return results, build_lod_pyramid(results) if self.lodActive() else None
+        return calculate
+
+    def _animationTick(self):
+        frame = self._animation.take()
+        self.animationFps.emit(self._animation.achievedFps(), self._animation.fps)
+        if frame is None or len(frame[2][0]) != len(self.points):
+            return  # Новый кадр не готов: остаётся прежний, GUI-поток не ждёт вычислений
+        _, self.time, (self._results, lod) = frame
+        self._resultsChanged()
+        self._lod = lod
+        self.resultsChanged.emit(0, len(self.points), len(self.points))
+        self.update()
+
+    def invalidateResults(self):
+        self._results = None
+        self._resultsChanged()
+        if self._job is not None:
+            # Задача считала изменения поверх старых результатов: пересоздаём её как полный пересчёт
+            self.scheduleEvaluation(*self._pending())
+        self.resultsChanged.emit(-1, -1, -1)
+
+    def _resultsChanged(self):
+        # Всё, что выводится из результатов, пересчитается при следующей отрисовке
+        self._bounds = None
+        self._lod = None
+
+    def getResults(self):
+        if self._results is None:
+            self._results = self.calculate_functions()
+        return self._results
+
+    def readyResults(self):
+        # Результаты для отрисовки и легенды; с фоновым пулом None, пока они считаются, - GUI-поток не ждёт
+        if self._results is None and self._executor is not None:
+            if self._job is None:
+                self.scheduleEvaluation(self.points, self.functions)
+            return None
+        return self.getResults()
+
+    def getBounds(self):
+        if self._bounds is None:
+            results = self.readyResults()
+            if results is None:
+                return self.determine_bounds(None)  # Пока результатов нет - границы по умолчанию, без кэша
+            self._bounds = self.determine_bounds(results)
+        return self._bounds
+
+    def calculate_matrix(self, points=None, functions=None, t=None):
+        points = self.points if points is None else points
+        functions = self.functions if functions is None else functions
+        t = self.time if t is None else t
+        return calculate_matrix([func.func for func in functions], points, t)
+
+    def calculate_functions(self, points=None, functions=None, t=None):
+        points = self.points if points is None else points
+        functions = self.functions if functions is None else functions
+        t = self.time if t is None else t
+        self.profiler.count("evals", len(points) * len(functions))
+        if self._sandbox is not None:
+            return self._sandboxResults(functions, points, t)
+        if self.vectorized:
+            return ResultStore.from_matrix(self.calculate_matrix(points, functions, t))
+        # Один проход по точкам для всех функций, общие подвыражения считаются один раз
+        return ResultStore.from_rows(evaluate_program([func.func for func in functions], points, t),
+                                     len(functions))
 
     def determine_bounds(self, results):
-        if not results or not any(results):
+        if not results or not results.series_count:
             return 10, -10
 
-        point_sums = []
-        for point_results in results:
-            positive_sum = 0
-            negative_sum = 0
-            for val in point_results:
-                if val is not None:
-                    if val > 0:
-                        positive_sum += val
-                    else:
-                        negative_sum += val
-            point_sums.append((positive_sum, negative_sum))
-
-        max_positive = max(ps[0] for ps in point_sums) if any(ps[0] > 0 for ps in point_sums) else 0
-        min_negative = min(ps[1] for ps in point_sums) if any(ps[1] < 0 for ps in point_sums) else 0
+        max_positive, min_negative = results.extent()
+        max_positive = max(max_positive, 0)
+        min_negative = min(min_negative, 0)
 
         max_val = math.ceil((max_positive + self.stepY) / self.stepY) * self.stepY
         min_val = math.floor((min_negative - self.stepY) / self.stepY) * self.stepY
@@ -155,23 +491,157 @@ class Grid(QWidget):
 
     def sizeHint(self):
         min_width = self.border_left + self.border_right + len(self.points) * self.point_spacing
-        return QSize(min_width, 400)  # Фиксированная высота 400, ширина зависит от точек
+        return QSize(int(min_width), 400)  # Фиксированная высота 400, ширина зависит от точек
 
     def minimumSizeHint(self):
         return self.sizeHint()
 
+    def setPointSpacing(self, spacing):
+        self._spacing = min(200, max(0.001, spacing))
+        self._fitSpacing()
+        self.updateGeometry()
+        self.update()
+
+    def _fitSpacing(self):
+        # Шире QWIDGETSIZE_MAX виджет не бывает: для длинного набора точек шаг уменьшается так,
+        # чтобы до последней точки можно было докрутить, а мелкий шаг рисуется через LOD
+        available = QWIDGETSIZE_MAX - self.border_left - self.border_right
+        self.point_spacing = min(self._spacing, available / max(1, len(self.points)))
+
+    def wheelEvent(self, event):
+        # Ctrl + колесо меняет масштаб по X, без Ctrl прокручивает окно прокрутки
+        if event.modifiers() & Qt.ControlModifier:
+            factor = 1.25 if event.angleDelta().y() > 0 else 0.8
+            self.setPointSpacing(self.point_spacing * factor)
+            event.accept()
+        else:
+            event.ignore()
+
+    def pointX(self, i):
+        return self.border_left + 30 + i * self.point_spacing
+
+    def visibleRange(self, rect):
+        # Индексы точек, столбики и подписи которых задевают rect; O(1) при любом числе точек
+        first = int((rect.left() - self.border_left - 30) // self.point_spacing) - 1
+        last = int((rect.right() - self.border_left - 30) // self.point_spacing) + 2
+        return max(0, first), max(0, min(len(self.points), last))
+
+    def lodActive(self):
+        return np is not None and self.point_spacing < LOD_SPACING
+
+    def lodLevel(self):
+        # Уровень пирамиды, на котором корзина не уже LOD_BIN_PX; переключение масштаба ничего не пересчитывает
+        if self._lod is None:
+            self._lod = build_lod_pyramid(self.getResults())
+        level = 0
+        while level < len(self._lod) - 1 and (1 << level) * self.point_spacing < LOD_BIN_PX:
+            level += 1
+        return level, self._lod[level]
+
+    def draw_lod(self, painter, first, last, zero_y, px_per_unit_y):
+        # Средние значения функций по корзинам соседних точек, плоскими стопками
+        level, (sums, counts) = self.lodLevel()
+        size = 1 << level
+        first_bin = first // size
+        last_bin = -(-last // size)
+        means = sums[first_bin:last_bin] / np.maximum(counts[first_bin:last_bin], 1)
+        bin_width = size * self.point_spacing
+        colors = [func.color for func in self.functions]
+
+        for b, row in enumerate(means.tolist(), first_bin):
+            left = self.pointX(b * size) - self.point_spacing / 2
+            pos_y = zero_y
+            neg_y = zero_y
+            for value, color in zip(row, colors):
+                height_px = abs(value) * px_per_unit_y
+                if value > 0:
+                    pos_y -= height_px
+                    painter.fillRect(QRectF(left, pos_y, bin_width, height_px), color)
+                elif value < 0:
+                    painter.fillRect(QRectF(left, neg_y, bin_width, height_px), color)
+                    neg_y += height_px
+        if self.profiler.enabled:
+            self.profiler.count("painter", int(np.count_nonzero(means)))
+
     def paintEvent(self, event):
+        profiler = self.profiler
         try:
             painter = QPainter(self)
-            self.draw_grid(painter)
-            self.draw_functions(painter)
-            self.drawLabels(painter)
+            with profiler.frame():
+                # Рисуем только столбцы, попавшие в открывшуюся область (например, в окне прокрутки)
+                first, last = self.visibleRange(event.rect())
+                with profiler.phase("evaluate"):
+                    results = self.readyResults()
+                with profiler.phase("bounds"):
+                    self.getBounds()
+                with profiler.phase("grid"):
+                    self.draw_background(painter, event.rect())
+                if results is not None:  # Иначе результаты ещё считаются в фоне: пока только сетка
+                    with profiler.phase("bars"):
+                        self.draw_functions(painter, first, last)
+                with profiler.phase("labels"):
+                    self.drawLabels(painter, first, last)
+            if profiler.overlay:
+                self.drawProfilerOverlay(painter, event.rect())
         except Exception as e:
-            print(f"Ошибка при отрисовке: {e}")
-
-    def draw_grid(self, painter):
-        results = self.calculate_functions()
-        max_val, min_val = self.determine_bounds(results)
+            profiler.error(e)
+            logger.exception("Ошибка при отрисовке")
+
+    def drawProfilerOverlay(self, painter, rect):
+        # Сводка держится в левом верхнем углу видимой части; если она не вся попала в перерисовку, дорисуем
+        corner = self.visibleRegion().boundingRect().topLeft()
+        overlay = self.profiler.draw_overlay(painter, corner.x(), corner.y())
+        if overlay is not None and not rect.contains(overlay.toAlignedRect()):
+            self.update(overlay.toAlignedRect())
+
+    def draw_background(self, painter, rect=None):
+        # Сетка, нулевая линия и подписи по Y кэшируются в картинках и пересчитываются только при смене ключа
+        self.maxY, self.minY = self.getBounds()
+        ratio = self.devicePixelRatioF()
+        key = (self.width(), self.height(), ratio, self.stepY, self.maxY, self.minY, self.perspective_depth)
+        if self._background_key != key:
+            self._background_tile = None
+            if self.width() <= BACKGROUND_CACHE_MAX_WIDTH:
+                self._background = [(0, self._backgroundPart(0, self.width(), ratio))]
+            else:
+                # Весь график в памяти не держим: по X сетка одинакова везде, кроме оси слева и правого края
+                # Куски начинаются на целый период штриха от начала линий: Qt начинает штрих заново у края картинки
+                start = self.border_left + self.perspective_depth
+                tail = self.width() - self.border_left - 2 * self.perspective_depth
+                tail = start + (tail - start) // DASH_PERIOD * DASH_PERIOD
+                self._background = [(0, self._backgroundPart(0, start, ratio)),
+                                    (tail, self._backgroundPart(tail, self.width() - tail, ratio))]
+                self._background_tile = (start, self._backgroundPart(start, BACKGROUND_TILE, ratio))
+            self._background_key = key
+
+        if self._background_tile is not None:
+            start, tile = self._background_tile
+            left, right = (rect.left(), rect.right() + 1) if rect is not None else (0, self.width())
+            x = start + max(0, (left - start) // BACKGROUND_TILE) * BACKGROUND_TILE
+            end = min(right, self._background[-1][0])
+            while x < end:
+                painter.drawPixmap(x, 0, tile)
+                x += BACKGROUND_TILE
+        for x, pixmap in self._background:
+            painter.drawPixmap(x, 0, pixmap)
+        self.profiler.count("painter", len(self._background))
+
+    def _backgroundPart(self, left, width, ratio):
+        # Участок [left, left + width) статического слоя, нарисованный в отдельную картинку
+        pixmap = QPixmap(QSize(width, self.height()) * ratio)
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(self.palette().window().color())
+        background_painter = QPainter(pixmap)
+        background_painter.setFont(self.font())
+        background_painter.translate(-left, 0)
+        self.draw_grid(background_painter, left)
+        background_painter.end()
+        return pixmap
+
+    def draw_grid(self, painter, left=0):
+        # left - левый край рисуемого участка: штриховые линии начинаются не левее него, на целый период
+        # штриха от начала сетки, иначе Qt начнёт штрих заново у края картинки со сдвигом
+        max_val, min_val = self.getBounds()
         self.maxY = max_val
         self.minY = min_val
 
@@ -200,33 +670,25 @@ class Grid(QWidget):
         pen.setStyle(Qt.DashLine)
         painter.setPen(pen)
 
-        # Рисуем горизонтальные линии сетки выше нуля
-        if self.maxY > 0:
-            y = zero_y
-            step = 0
-            while y >= self.padding_top:
-                painter.drawLine(self.border_left + self.perspective_depth, y - self.perspective_depth,
-                                 self.border_left + width + self.perspective_depth, y - self.perspective_depth)
-                painter.drawText(self.border_left - self.perspective_depth * 5, y + 5, format_value(step * self.stepY))
-                step += 1
-                y = zero_y - step * (height / (self.maxY - self.minY)) * self.stepY
-                painter.drawLine(self.border_left, y, self.border_left + self.perspective_depth,
-                                 y - self.perspective_depth)
-
-        # Рисуем горизонтальные линии сетки ниже нуля
-        if self.minY < 0:
-            y = zero_y
-            step = 1
-            while y <= self.padding_top + height:
-                y = zero_y + step * (height / (self.maxY - self.minY)) * self.stepY
-                if y > self.padding_top + height:
-                    break
-                painter.drawLine(self.border_left + self.perspective_depth, y - self.perspective_depth,
-                                 self.border_left + width + self.perspective_depth, y - self.perspective_depth)
-                painter.drawText(self.border_left - self.perspective_depth * 5, y + 5, format_value(-step * self.stepY))
-                step += 1
-                painter.drawLine(self.border_left, y, self.border_left + self.perspective_depth,
-                                 y - self.perspective_depth)
+        # Шаг пользователя - только подсказка: линии не чаще MIN_TICK_PX пикселей
+        px_per_unit_y = height / (self.maxY - self.minY)
+        step = tick_step(self.stepY, px_per_unit_y)
+        lines, diagonals = y_ticks(zero_y, self.padding_top, self.padding_top + height, px_per_unit_y, step,
+                                   self.maxY > 0, self.minY < 0)
+
+        # Горизонтальные линии сетки и короткие диагонали к ним от оси
+        line_left = self.border_left + self.perspective_depth
+        if left > line_left:
+            line_left += (left - line_left) // DASH_PERIOD * DASH_PERIOD
+        for y, _ in lines:
+            painter.drawLine(line_left, y - self.perspective_depth,
+                             self.border_left + width + self.perspective_depth, y - self.perspective_depth)
+        for y in diagonals:
+            painter.drawLine(self.border_left, y, self.border_left + self.perspective_depth,
+                             y - self.perspective_depth)
+        for y, label in lines:
+            painter.drawText(self.border_left - self.perspective_depth * 5, y + 5, label)
+        self.profiler.count("painter", 2 * len(lines) + len(diagonals))
 
         # Нулевая линия
         if self.maxY > 0 and self.minY < 0:
@@ -248,10 +710,11 @@ class Grid(QWidget):
                              self.border_left + width + self.perspective_depth, zero_y - self.perspective_depth)
             painter.drawLine(self.border_left, zero_y, self.border_left + self.perspective_depth,
                              zero_y - self.perspective_depth)
+            self.profiler.count("painter", 3)
 
-    def draw_functions(self, painter):
-        results = self.calculate_functions()
-        if not results or not self.points:
+    def draw_functions(self, painter, first=0, last=None):
+        results = self.getResults()
+        if not results or len(self.points) == 0:
             return
 
         width = max(1, self.width() - self.border_left - self.border_right)
@@ -266,106 +729,120 @@ class Grid(QWidget):
             zero_y = self.padding_top + height * (self.maxY / (self.maxY - self.minY))
 
         px_per_unit_y = height / (self.maxY - self.minY) if (self.maxY - self.minY) != 0 else 0
-        x_positions = [self.border_left + 30 + i * self.point_spacing for i in range(len(self.points))]
+        last = len(self.points) if last is None else last
+
+        if self.lodActive():
+            self.draw_lod(painter, first, last, zero_y, px_per_unit_y)
+            return
+
+        # Грани собираются в один путь на функцию и оттенок и рисуются одной сменой кисти на каждый:
+        # столбики разных точек не пересекаются, а порядок функций в стопке сохраняется
+        d = self.perspective_depth
+        paths = [(QPainterPath(), QPainterPath(), QPainterPath()) for _ in self.functions]
 
-        for i, (point, x) in enumerate(zip(self.points, x_positions)):
+        for i, row in enumerate(results.window(first, last), first):
+            x = int(self.pointX(i))
             pos_y = zero_y
             neg_y = zero_y
 
-            for j, func in enumerate(self.functions):
-                if j >= len(results[i]) or results[i][j] is None:
-                    continue
-
-                value = results[i][j]
+            for j in range(min(len(row), len(self.functions))):
+                value = row[j]
                 if value is None:
                     continue
 
                 height_px = abs(value) * px_per_unit_y
-                color = func["color"]
-                darker_color = color.darker(120)
-                more_darker_color = color.darker(150)
+                main_path, top_path, side_path = paths[j]
 
                 if value >= 0:
+                    top = int(pos_y - height_px)
+                    bottom = int(pos_y)
                     # Основной прямоугольник
-                    main_rect = QRect(x - 15, pos_y - height_px, 30, height_px)
-
+                    main_path.addRect(x - 15, top, 30, int(height_px))
                     # Верхняя грань (параллелограмм)
-                    top_poly = QPolygon([
-                        QPoint(x - 15, pos_y - height_px),
-                        QPoint(x - 15 + self.perspective_depth, pos_y - height_px - self.perspective_depth),
-                        QPoint(x + 15 + self.perspective_depth, pos_y - height_px - self.perspective_depth),
-                        QPoint(x + 15, pos_y - height_px)
-                    ])
-
+                    add_polygon(top_path, ((x - 15, top), (x - 15 + d, int(pos_y - height_px - d)),
+                                           (x + 15 + d, int(pos_y - height_px - d)), (x + 15, top)))
                     # Боковая грань (параллелограмм)
-                    side_poly = QPolygon([
-                        QPoint(x + 15, pos_y - height_px),
-                        QPoint(x + 15 + self.perspective_depth, pos_y - height_px - self.perspective_depth),
-                        QPoint(x + 15 + self.perspective_depth, pos_y - self.perspective_depth),
-                        QPoint(x + 15, pos_y)
-                    ])
-
-                    # Рисуем боковую грань
-                    painter.setBrush(QBrush(more_darker_color))
-                    painter.setPen(QPen(more_darker_color, 1))
-                    painter.drawPolygon(side_poly)
-
-                    # Рисуем верхнюю грань
-                    painter.setBrush(QBrush(darker_color))
-                    painter.setPen(QPen(darker_color, 1))
-                    painter.drawPolygon(top_poly)
-
-                    # Рисуем основной прямоугольник
-                    painter.setBrush(QBrush(color))
-                    painter.setPen(QPen(color, 1))
-                    painter.drawRect(main_rect)
-
+                    add_polygon(side_path, ((x + 15, top), (x + 15 + d, int(pos_y - height_px - d)),
+                                            (x + 15 + d, int(pos_y - d)), (x + 15, bottom)))
                     pos_y -= height_px
                 else:
+                    top = int(neg_y)
                     # Основной прямоугольник (вниз от нулевой линии)
-                    main_rect = QRect(x - 15, neg_y, 30, height_px)
-
+                    main_path.addRect(x - 15, top, 30, int(height_px))
                     # Боковая грань
-                    side_poly = QPolygon([
-                        QPoint(x + 15, neg_y),
-                        QPoint(x + 15 + self.perspective_depth, neg_y - self.perspective_depth),
-                        QPoint(x + 15 + self.perspective_depth, neg_y + height_px - self.perspective_depth),
-                        QPoint(x + 15, neg_y + height_px)
-                    ])
-
-                    # Рисуем боковую грань
-                    painter.setBrush(QBrush(more_darker_color))
-                    painter.setPen(QPen(more_darker_color, 1))
-                    painter.drawPolygon(side_poly)
-
-                    # Рисуем основной прямоугольник
-                    painter.setBrush(QBrush(color))
-                    painter.setPen(QPen(color, 1))
-                    painter.drawRect(main_rect)
-
+                    add_polygon(side_path, ((x + 15, top), (x + 15 + d, int(neg_y - d)),
+                                            (x + 15 + d, int(neg_y + height_px - d)), (x + 15, int(neg_y + height_px))))
                     neg_y += height_px
 
-    def drawLabels(self, painter):
-        if not self.points:
+        for func, func_paths in zip(self.functions, paths):
+            # Порядок как у одиночного столбика: боковая грань, верхняя, основной прямоугольник
+            for (brush, pen), path in zip(reversed(func.styles), reversed(func_paths)):
+                if not path.isEmpty():
+                    painter.setBrush(brush)
+                    painter.setPen(pen)
+                    painter.drawPath(path)
+                    self.profiler.count("painter")
+
+    def drawLabels(self, painter, first=0, last=None):
+        if len(self.points) == 0:
             return
 
         y_pos = self.height() - self.padding_bottom // 2
-        x_positions = [self.border_left + 30 + i * self.point_spacing for i in range(len(self.points))]
+        last = len(self.points) if last is None else last
 
         font = painter.font()
         font.setPointSize(10)
         painter.setFont(font)
         painter.setPen(QPen(Qt.black, 1))
 
-        for point, x in zip(self.points, x_positions):
-            painter.drawText(x - 15, y_pos, format_value(point))
+        # Прореживаем подписи по ширине самой длинной из видимых, чтобы они не налезали друг на друга
+        stride = self.labelStride(painter.fontMetrics(), first, last)
+        labels = range(first - first % stride, last, stride)
+        for i in labels:
+            painter.drawText(self.pointX(i) - 15, y_pos, format_value(self.points[i]))
+        self.profiler.count("painter", len(labels))
+
+    def labelStride(self, metrics, first, last):
+        if last <= first:
+            return 1
+        sample = range(first, last, max(1, (last - first) // 16))
+        label_width = max(metrics.horizontalAdvance(format_value(self.points[i])) for i in sample)
+        return max(1, math.ceil((label_width + LABEL_GAP) / self.point_spacing))
 
     def setFunctions(self, functions):
-        self.functions = []
-        for func in functions:
-            self.functions.append({
-                "func": func["func"],
-                "color": QColor(func["color"]),
-                "name": func["name"]
-            })
-        self.update()
\ No newline at end of file
+        # Описания функций словарями {"func", "color", "name"}; в Grid они становятся сериями реестра
+        self.replaceFunctions([make_function(func["func"], func["color"], func.get("name"))
+                               for func in functions])
+
+    def reloadFunctions(self):
+        clear_failed()
+        self.replaceFunctions(self.getFuncs(self.functions_path))  # Перечитываем функции из файла
+
+    def replaceFunctions(self, functions):
+        # Реестр отдаёт неизменившиеся функции (то же выражение, цвет и имя) прежними объектами,
+        # так что их результаты переиспользуются
+        current = self._pending()[1]
+        if len(functions) == len(current) and all(a is b for a, b in zip(functions, current)):
+            return
+        self.scheduleEvaluation(self._pending()[0], functions)
+
+    def watchFunctionsFile(self, path=None):
+        # Перечитываем файл функций, когда его переписывают, с паузой на серию изменений
+        self.functions_path = path or self.functions_path
+        if self._watcher is None:
+            self._watcher = QFileSystemWatcher(self)
+            self._watcher.fileChanged.connect(self._functionsFileChanged)
+            self._watcher.directoryChanged.connect(self._functionsFileChanged)
+            self._reload_timer = QTimer(self)
+            self._reload_timer.setSingleShot(True)
+            self._reload_timer.setInterval(RELOAD_DEBOUNCE_MS)
+            self._reload_timer.timeout.connect(self.reloadFunctions)
+        # Каталог тоже отслеживаем: генераторы часто заменяют файл целиком
+        self._watcher.addPath(os.path.dirname(os.path.abspath(self.functions_path)))
+        if os.path.exists(self.functions_path):
+            self._watcher.addPath(self.functions_path)
+
+    def _functionsFileChanged(self, path):
+        if os.path.exists(self.functions_path) and self.functions_path not in self._watcher.files():
+            self._watcher.addPath(self.functions_path)
+        self._reload_timer.start()
\ No newline at end of file
@@ -0,0 +1,152 @@
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from GridRender import _init_worker
+
+POINT_COUNTS = [10, 1000, 100_000, 1_000_000]
+FUNCTION_COUNTS = [1, 4, 16]
+Y_STEPS = [0.1, 1, 10]
+QUICK_POINT_COUNTS = [10, 1000, 10_000]
+VIEW_WIDTH = 1600  # Видимая часть графика, как в окне с прокруткой
+VIEW_HEIGHT = 600
+TOLERANCE = 0.2  # Замедление больше чем на 20% считается регрессией
+NOISE_SECONDS = 0.002  # Разница меньше этой - шум таймера, а не регрессия
+NOISE_BYTES = 64 * 1024
+
+EXPRESSIONS = ["4/(1-x)", "x**2", "5*math.sin(x)", "math.log(abs(x)+1)"]
+COLORS = ["red", "green", "blue", "magenta", "cyan", "yellow", "darkRed", "darkGreen"]
+
+
+def make_functions(count):
+    # Разные коэффициенты, чтобы общие подвыражения не схлопнули функции в одну
+    from PySide6.QtGui import QColor
+    from Grid import make_function
+    return [make_function(f"{i // len(EXPRESSIONS) + 1}*({EXPRESSIONS[i % len(EXPRESSIONS)]})",
+                          QColor(COLORS[i % len(COLORS)]))
+            for i in range(count)]
+
+
+def make_points_text(count):
+    return ", ".join(str(round(-5 + 10 * i / count, 6)) for i in range(count))
+
+
+def measure(func, repeat):
+    """Лучшее время из repeat запусков и пиковая память отдельного запуска под tracemalloc"""
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def run_benchmarks(point_counts=POINT_COUNTS, function_counts=FUNCTION_COUNTS, y_steps=Y_STEPS, progress=None):
+    """Прогоняет этапы Grid по сетке параметров, возвращает {ключ: {name, params, seconds, peak_bytes}}"""
+    _init_worker()
+    from PySide6.QtCore import QPoint
+    from PySide6.QtGui import QImage, QRegion
+    from Grid import Grid
+
+    results = {}
+
+    def record(name, params, func):
+        repeat = 1 if params.get("points", 0) >= 100_000 else 5
+        seconds, peak = measure(func, repeat)
+        key = name + "[" + ",".join(f"{k}={v}" for k, v in params.items()) + "]"
+        results[key] = {"name": name, "params": params, "seconds": seconds, "peak_bytes": peak}
+        if progress is not None:
+            progress(key, seconds, peak)
+
+    for n in point_counts:
+        grid = Grid()
+        text = make_points_text(n)
+        record("setPoints", {"points": n}, lambda: grid.setPoints(text))
+        points = grid.points
+
+        for count in function_counts:
+            grid.functions = make_functions(count)
+            grid.invalidateResults()
+            record("calculate_functions", {"points": n, "functions": count},
+                   lambda: grid.calculate_functions(points))
+            results_rows = grid.getResults()
+
+            for step in y_steps:
+                grid.setYStep(step)
+                params = {"points": n, "functions": count, "stepY": step}
+                record("determine_bounds", params, lambda: grid.determine_bounds(results_rows))
+
+                grid.resize(grid.sizeHint().width(), VIEW_HEIGHT)
+                image = QImage(VIEW_WIDTH, VIEW_HEIGHT, QImage.Format_ARGB32_Premultiplied)
+                region = QRegion(0, 0, VIEW_WIDTH, VIEW_HEIGHT)
+
+                def paint():
+                    grid._background_key = None  # Каждый раз рисуем и сетку, а не только кэш
+                    grid.render(image, QPoint(), region)
+                record("paintEvent", params, paint)
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Список (ключ, метрика, было, стало) для замеров, которые хуже базовых больше чем на tolerance"""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric, noise in (("seconds", NOISE_SECONDS), ("peak_bytes", NOISE_BYTES)):
+            if result[metric] > base[metric] * (1 + tolerance) and result[metric] - base[metric] > noise:
+                regressions.append((key, metric, base[metric], result[metric]))
+    return regressions
+
+
+def save_baseline(path, results):
+    data = {"python": platform.python_version(), "machine": platform.machine(), "results": results}
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False, indent=1)
+
+
+def load_baseline(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)["results"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры вычисления и отрисовки Grid")
+    parser.add_argument("--quick", action="store_true", help="только небольшие наборы точек")
+    parser.add_argument("--save", metavar="JSON", help="сохранить результаты как базовые")
+    parser.add_argument("--compare", metavar="JSON", help="сравнить с сохранёнными базовыми результатами")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="допустимое ухудшение (0.2 - 20%%)")
+    args = parser.parse_args(argv)
+
+    def progress(key, seconds, peak):
+        print(f"{key:60} {seconds * 1000:10.2f} мс {peak / 1024 / 1024:9.2f} МиБ")
+
+    point_counts = QUICK_POINT_COUNTS if args.quick else POINT_COUNTS
+    results = run_benchmarks(point_counts, progress=progress)
+
+    if args.save:
+        save_baseline(args.save, results)
+    if args.compare:
+        regressions = compare(results, load_baseline(args.compare), args.tolerance)
+        for key, metric, before, after in regressions:
+            print(f"РЕГРЕССИЯ {key} {metric}: {before:.6g} -> {after:.6g} ({after / max(before, 1e-12) - 1:+.0%})")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
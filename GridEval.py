@@ -0,0 +1,545 @@
+import ast
+import math
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from types import SimpleNamespace
+
+from GridStore import ResultStore
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Сколько скомпилированных выражений держим в кэше
+EXPRESSION_CACHE_SIZE = 256
+
+# Выражения, превысившие бюджет времени или памяти: больше не вычисляются
+_failed_expressions = set()
+
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def compile_function(expr):
+    """Разбирает и компилирует выражение функции один раз, None если оно некорректно"""
+    try:
+        return compile(expr, "<function>", "eval")
+    except (SyntaxError, ValueError):
+        return None
+
+
+def mark_failed(expr):
+    _failed_expressions.add(expr)
+
+
+def is_failed(expr):
+    return expr in _failed_expressions
+
+
+def clear_failed():
+    # Перечитанный файл функций - повод попробовать выражения ещё раз
+    _failed_expressions.clear()
+
+
+def evaluate_scalar(code, points, t=0.0):
+    """Вычисляет скомпилированное выражение в каждой точке, None там где значение не определено"""
+    values = []
+    if code is None:
+        return [None] * len(points)
+    if np is not None and isinstance(points, np.ndarray):
+        points = points.tolist()  # Скаляры NumPy делят на ноль без исключения
+    env = {'math': math, 't': t}
+    for point in points:
+        env['x'] = point
+        try:
+            y = eval(code, env)
+            values.append(y if y is not None and not math.isnan(y) else None)
+        except MemoryError:
+            raise  # Превышение бюджета памяти должно дойти до песочницы, а не стать "не определено"
+        except:
+            values.append(None)
+    return values
+
+
+def changed_range(old, new):
+    """Границы изменившегося участка: (начало, конец в old, конец в new) после отсечения общих краёв"""
+    n = min(len(old), len(new))
+    if np is not None and (isinstance(old, np.ndarray) or isinstance(new, np.ndarray)):
+        return _changed_range_vector(np.asarray(old, dtype=np.float64), np.asarray(new, dtype=np.float64), n)
+    start = 0
+    while start < n and old[start] == new[start]:
+        start += 1
+    end = 0
+    while end < n - start and old[len(old) - 1 - end] == new[len(new) - 1 - end]:
+        end += 1
+    return start, len(old) - end, len(new) - end
+
+
+class EvaluationJob:
+    """Фоновое вычисление участка строк результатов, которое можно отменить"""
+    CHUNK = 4096  # Между кусками проверяем, не отменили ли задачу
+
+    def __init__(self, points, functions, start, old_end, new_end, calculate, mode="rows"):
+        self.points = points
+        self.functions = functions
+        self.mode = mode  # rows - участок точек, columns - новые функции, full - всё, lazy - ничего
+        self.start = start
+        self.old_end = old_end
+        self.new_end = new_end
+        self.calculate = calculate
+        self.rows = None  # ResultStore с результатами участка
+        self.refine = None  # (points, rows) -> (points, rows), например адаптивное уточнение
+        self.future = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def run(self):
+        if self.calculate is None:
+            self.rows = []
+            return
+        segment = self.points[self.start:self.new_end]
+        parts = []
+        for i in range(0, len(segment), self.CHUNK):
+            if self._cancelled.is_set():
+                return
+            parts.append(self.calculate(segment[i:i + self.CHUNK]))
+        rows = ResultStore.concat(parts)
+        if self.refine is not None and not self._cancelled.is_set():
+            self.points, rows = self.refine(self.points, rows)
+        if not self._cancelled.is_set():
+            self.rows = rows
+
+
+class FrameScheduler:
+    """Считает кадры f(x, t) наперёд в отдельном потоке и держит их в ограниченном кольцевом буфере.
+
+    Кадр k соответствует t = k / fps. Если вычисление отстаёт от часов, просроченные кадры
+    пропускаются, а не догоняются; take() отдаёт последний готовый кадр, не дожидаясь нового.
+    """
+    CAPACITY = 8
+
+    def __init__(self, calculate, fps, capacity=CAPACITY):
+        self.fps = fps
+        self.capacity = capacity
+        self.dropped = 0  # Кадры, посчитанные или запланированные, но так и не показанные
+        self._calculate = calculate  # t -> результаты кадра
+        self._frames = deque()  # (номер, t, результаты) по возрастанию номера
+        self._condition = threading.Condition()
+        self._next = 0
+        self._generation = 0
+        self._running = False
+        self._start = 0.0
+        self._shown = deque()  # Моменты показа кадров за последнюю секунду
+        self._thread = None
+
+    def start(self):
+        self._start = time.perf_counter()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="grid-frames", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._frames.clear()
+            self._condition.notify_all()
+
+    def reset(self, calculate):
+        # Новые точки или функции: готовые кадры устарели, считаем дальше уже по новым
+        with self._condition:
+            self._calculate = calculate
+            self._generation += 1
+            self._frames.clear()
+            self._next = self.frameIndex()
+            self._condition.notify_all()
+
+    def frameIndex(self):
+        return int((time.perf_counter() - self._start) * self.fps)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and len(self._frames) >= self.capacity:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                now = self.frameIndex()
+                if self._next < now:
+                    self.dropped += now - self._next  # Отстали: эти кадры уже не нужны
+                    self._next = now
+                index = self._next
+                self._next += 1
+                calculate = self._calculate
+                generation = self._generation
+            try:
+                results = calculate(index / self.fps)
+            except Exception:
+                results = None
+            with self._condition:
+                if generation == self._generation and results is not None:
+                    self._frames.append((index, index / self.fps, results))
+
+    def take(self):
+        """Самый свежий готовый кадр, время которого наступило, или None; более старые отбрасываются"""
+        now = self.frameIndex()
+        frame = None
+        with self._condition:
+            while self._frames and self._frames[0][0] <= now:
+                if frame is not None:
+                    self.dropped += 1
+                frame = self._frames.popleft()
+            self._condition.notify_all()
+        if frame is not None:
+            shown = time.perf_counter()
+            self._shown.append(shown)
+            while self._shown and self._shown[0] < shown - 1.0:
+                self._shown.popleft()
+        return frame
+
+    def achievedFps(self):
+        # Сколько кадров показано за последнюю секунду
+        while self._shown and self._shown[0] < time.perf_counter() - 1.0:
+            self._shown.popleft()
+        return len(self._shown)
+
+
+def _jump(a, b, scales):
+    # Насколько резко меняются значения между соседними точками, в долях размаха каждой функции
+    score = 0.0
+    for va, vb, scale in zip(a, b, scales):
+        if (va is None) != (vb is None):
+            return math.inf
+        if va is not None and scale > 0:
+            score = max(score, abs(va - vb) / scale)
+    return score
+
+
+def refine_samples(points, store, calculate, threshold=0.1, max_depth=6, budget=2000):
+    """Добавляет середины между соседними точками там, где значения какой-то функции резко меняются"""
+    points = points.tolist() if hasattr(points, 'tolist') else list(points)
+    if len(points) < 2 or not store.series_count:
+        return points, store
+    rows = list(store)
+
+    scales = []
+    for column in zip(*rows):
+        values = [v for v in column if v is not None and math.isfinite(v)]
+        scales.append(max(values) - min(values) if values else 0.0)
+
+    for _ in range(max_depth):
+        if budget <= 0:
+            break
+        jumps = [(_jump(rows[i], rows[i + 1], scales), i) for i in range(len(points) - 1)]
+        sharp = sorted((jump for jump in jumps if jump[0] > threshold), reverse=True)[:budget]
+        # Середины, неотличимые от концов отрезка во float, не добавляем
+        sharp = [i for _, i in sharp if points[i] != (points[i] + points[i + 1]) / 2 != points[i + 1]]
+        if not sharp:
+            break
+        sharp.sort()
+        mids = [(points[i] + points[i + 1]) / 2 for i in sharp]
+        mid_rows = calculate(mids)
+        budget -= len(mids)
+
+        refined_points = []
+        refined_rows = []
+        previous = 0
+        for i, mid, mid_row in zip(sharp, mids, mid_rows):
+            refined_points.extend(points[previous:i + 1])
+            refined_rows.extend(rows[previous:i + 1])
+            refined_points.append(mid)
+            refined_rows.append(mid_row)
+            previous = i + 1
+        refined_points.extend(points[previous:])
+        refined_rows.extend(rows[previous:])
+        points, rows = refined_points, refined_rows
+    return points, ResultStore.from_rows(rows, store.series_count)
+
+
+def build_lod_pyramid(store):
+    """Многоуровневые сводки для LOD: на уровне k суммы и число определённых значений по 2**k точек"""
+    matrix = store.values.T
+    valid = store.valid.T & np.isfinite(matrix)
+    levels = [(np.where(valid, matrix, 0.0), valid.astype(np.int64))]
+    while len(levels[-1][0]) > 1:
+        sums, counts = levels[-1]
+        if len(sums) % 2:
+            sums = np.vstack([sums, np.zeros((1, sums.shape[1]))])
+            counts = np.vstack([counts, np.zeros((1, counts.shape[1]), dtype=np.int64)])
+        levels.append((sums[0::2] + sums[1::2], counts[0::2] + counts[1::2]))
+    return levels
+
+
+def _changed_range_vector(old, new, n):
+    differ = np.flatnonzero(old[:n] != new[:n])
+    start = int(differ[0]) if len(differ) else n
+    differ = np.flatnonzero(old[len(old) - (n - start):][::-1] != new[len(new) - (n - start):][::-1])
+    end = int(differ[0]) if len(differ) else n - start
+    return start, len(old) - end, len(new) - end
+
+
+def merge_columns(store, old_functions, new_functions, added, added_store):
+    """Результаты для нового набора функций: прежние столбцы из store, новые из added_store"""
+    old_index = {id(func): k for k, func in enumerate(old_functions)}
+    added_index = {id(func): k for k, func in enumerate(added)}
+    sources = [(store, old_index[id(func)]) if id(func) in old_index else (added_store, added_index[id(func)])
+               for func in new_functions]
+    return ResultStore.stack(sources, len(store))
+
+
+def _np_log(x, base=None):
+    if base is None:
+        return np.log(x)
+    return np.log(x) / np.log(base)
+
+
+if np is not None:
+    # Словарь math.* из Функции.txt, отображённый на ufunc-и NumPy
+    NUMPY_MATH = SimpleNamespace(
+        sin=np.sin, cos=np.cos, tan=np.tan, asin=np.arcsin, acos=np.arccos, atan=np.arctan, atan2=np.arctan2,
+        sinh=np.sinh, cosh=np.cosh, tanh=np.tanh, asinh=np.arcsinh, acosh=np.arccosh, atanh=np.arctanh,
+        exp=np.exp, expm1=np.expm1, log=_np_log, log10=np.log10, log2=np.log2, log1p=np.log1p,
+        sqrt=np.sqrt, cbrt=np.cbrt, pow=np.power, fabs=np.fabs, floor=np.floor, ceil=np.ceil, trunc=np.trunc,
+        hypot=np.hypot, fmod=np.fmod, copysign=np.copysign, degrees=np.degrees, radians=np.radians,
+        pi=math.pi, e=math.e, tau=math.tau, inf=math.inf, nan=math.nan
+    )
+    NUMPY_BUILTINS = {'abs': np.abs, 'round': np.round}
+else:
+    NUMPY_MATH = None
+    NUMPY_BUILTINS = {}
+
+
+def _vector_column(value, xs):
+    # Результат выражения на векторе точек как столбец float64, None если это не числовой вектор
+    column = np.asarray(value)
+    if column.dtype.kind not in 'biuf':
+        return None
+    try:
+        return np.broadcast_to(column.astype(np.float64), xs.shape)
+    except ValueError:
+        return None
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError, OverflowError):
+        return math.nan
+
+
+def calculate_matrix(exprs, points, t=0.0):
+    """Матрица значений точки x функции (float64), NaN вместо неопределённых и бесконечных значений"""
+    xs = np.asarray(points, dtype=np.float64)
+    program = compile_program(tuple(exprs))
+    try:
+        with np.errstate(all='ignore'):
+            values = program.vector(xs, t)
+    except MemoryError:
+        raise
+    except Exception:
+        values = (_ERR,) * len(exprs)
+    # Память по функциям подряд: ResultStore забирает транспонированную матрицу без копии
+    columns = np.empty((len(exprs), len(xs)))
+    for j, (expr, value) in enumerate(zip(exprs, values)):
+        column = None if value is _ERR else _vector_column(value, xs)
+        if column is None:
+            # Скалярный путь для выражений, которые NumPy не потянул
+            column = [math.nan if v is None else _to_float(v)
+                      for v in evaluate_scalar(compile_function(expr), points, t)]
+        columns[j] = column
+    columns[~np.isfinite(columns)] = np.nan
+    return columns.T
+
+
+# Общие подвыражения: набор функций разбирается в один DAG, и одинаковые поддеревья,
+# например math.sin(x) в нескольких сериях, вычисляются один раз на точку (или на вектор точек)
+
+class _Error:
+    # Значение-маркер "вычислить не удалось", распространяется на всё, что от него зависит
+    def __repr__(self):
+        return "_ERR"
+
+
+_ERR = _Error()
+
+# Узлы с ленивым вычислением: внутрь не заглядываем, иначе поднятые наружу подвыражения
+# вычислялись бы и там, где Python их пропускает
+_OPAQUE = (ast.IfExp, ast.BoolOp, ast.Lambda, ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp,
+           ast.NamedExpr)
+_LEAVES = (ast.Name, ast.Constant, ast.Attribute)
+
+
+def _uses_x(node):
+    # Поддеревья, зависящие от точки или времени; остальное - константы
+    return any(isinstance(n, ast.Name) and n.id in ('x', 't') for n in ast.walk(node))
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+# Что можно вызывать в выражении из непроверенного источника (например, из HTTP-запроса)
+SAFE_NAMES = frozenset({'x', 't', 'math', 'abs', 'round', 'min', 'max', 'pow', 'int', 'float'})
+_SAFE_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp, ast.Call, ast.Name,
+               ast.Constant, ast.Attribute, ast.operator, ast.unaryop, ast.boolop, ast.cmpop, ast.Load)
+
+
+def check_expression(expr):
+    """ExpressionError, если выражение выходит за арифметику над x, t, math.* и SAFE_NAMES.
+
+    Без атрибутов, кроме публичных имён math, и без строк из выражения не добраться ни до импорта,
+    ни до внутренностей объектов, так что вычислять его можно обычным eval.
+    """
+    try:
+        tree = ast.parse(expr, mode='eval')
+    except (SyntaxError, ValueError) as e:
+        raise ExpressionError(f"{expr!r}: {e}")
+    for node in ast.walk(tree):
+        if not isinstance(node, _SAFE_NODES):
+            raise ExpressionError(f"{expr!r}: недопустимая конструкция {type(node).__name__}")
+        if isinstance(node, ast.Name) and node.id not in SAFE_NAMES:
+            raise ExpressionError(f"{expr!r}: недопустимое имя {node.id!r}")
+        if isinstance(node, ast.Attribute) and not (isinstance(node.value, ast.Name) and node.value.id == 'math'
+                                                    and not node.attr.startswith('_') and hasattr(math, node.attr)):
+            raise ExpressionError(f"{expr!r}: недопустимый атрибут {node.attr!r}")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ExpressionError(f"{expr!r}: допустимы только числовые константы")
+        if isinstance(node, ast.Call) and node.keywords:
+            raise ExpressionError(f"{expr!r}: именованные аргументы не поддерживаются")
+
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def uses_time(expr):
+    """Зависит ли выражение от времени t"""
+    try:
+        tree = ast.parse(expr, mode='eval')
+    except (SyntaxError, ValueError):
+        return False
+    return any(isinstance(n, ast.Name) and n.id == 't' for n in ast.walk(tree))
+
+
+def _children(node):
+    if isinstance(node, _OPAQUE) or isinstance(node, _LEAVES):
+        return []
+    if isinstance(node, ast.Call):
+        return list(node.args) + [keyword.value for keyword in node.keywords]
+    return [child for child in ast.iter_child_nodes(node) if isinstance(child, ast.expr)]
+
+
+def _count_subtrees(node, counts):
+    if not isinstance(node, _LEAVES) and _uses_x(node):
+        key = ast.dump(node)
+        counts[key] = counts.get(key, 0) + 1
+    for child in _children(node):
+        _count_subtrees(child, counts)
+
+
+class _Hoister(ast.NodeTransformer):
+    # Заменяет общие поддеревья именами временных переменных, определения копит в порядке зависимостей
+    def __init__(self, shared):
+        self.shared = shared
+        self.names = {}
+        self.definitions = []
+
+    def visit(self, node):
+        key = ast.dump(node) if _is_expr(node) else None
+        if not isinstance(node, _OPAQUE):
+            for field, value in ast.iter_fields(node):
+                if isinstance(node, ast.Call) and field == 'func':
+                    continue
+                if isinstance(value, list):
+                    setattr(node, field, [self.visit(item) if isinstance(item, ast.AST) else item for item in value])
+                elif isinstance(value, ast.AST):
+                    setattr(node, field, self.visit(value))
+        if key is not None and key in self.shared:
+            if key not in self.names:
+                name = f"_cse{len(self.names)}"
+                self.names[key] = name
+                self.definitions.append((name, node))
+            return ast.copy_location(ast.Name(id=self.names[key], ctx=ast.Load()), node)
+        return node
+
+
+def _is_expr(node):
+    return isinstance(node, ast.expr) and not isinstance(node, _LEAVES)
+
+
+def _emit(lines, name, node):
+    deps = sorted({n.id for n in ast.walk(node) if isinstance(n, ast.Name) and n.id.startswith('_cse')})
+    lines.append(f"    {name} = _ERR")
+    condition = " and ".join(f"{dep} is not _ERR" for dep in deps) or "True"
+    lines.append(f"    if {condition}:")
+    lines.append("        try:")
+    lines.append(f"            {name} = {ast.unparse(node)}")
+    lines.append("        except MemoryError:")
+    lines.append("            raise")
+    lines.append("        except Exception:")
+    lines.append("            pass")
+
+
+class SeriesProgram:
+    """Все функции набора, собранные в одну функцию point -> кортеж значений серий"""
+
+    def __init__(self, exprs):
+        self.exprs = exprs
+        trees = []
+        for expr in exprs:
+            try:
+                trees.append(ast.parse(expr, mode='eval').body)
+            except (SyntaxError, ValueError):
+                trees.append(None)
+
+        counts = {}
+        for tree in trees:
+            if tree is not None:
+                _count_subtrees(tree, counts)
+        hoister = _Hoister({key for key, count in counts.items() if count > 1})
+        trees = [hoister.visit(tree) if tree is not None else None for tree in trees]
+        self.shared = len(hoister.definitions)
+
+        lines = ["def _program(x, t=0.0):"]
+        for name, node in hoister.definitions:
+            _emit(lines, name, node)
+        for k, tree in enumerate(trees):
+            if tree is None:
+                lines.append(f"    _res{k} = _ERR")
+            else:
+                _emit(lines, f"_res{k}", tree)
+        lines.append("    return (" + "".join(f"_res{k}, " for k in range(len(trees))) + ")")
+        code = compile("\n".join(lines), "<functions>", "exec")
+
+        # Один и тот же код исполняется со скалярным math и с NumPy
+        scalar_env = {'math': math, '_ERR': _ERR}
+        exec(code, scalar_env)
+        self.scalar = scalar_env['_program']
+        if np is not None:
+            vector_env = {'math': NUMPY_MATH, '_ERR': _ERR}
+            vector_env.update(NUMPY_BUILTINS)
+            exec(code, vector_env)
+            self.vector = vector_env['_program']
+
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def compile_program(exprs):
+    return SeriesProgram(exprs)
+
+
+def _clean(value):
+    if value is _ERR or value is None:
+        return None
+    try:
+        return None if math.isnan(value) else value
+    except:
+        return None
+
+
+def evaluate_program(exprs, points, t=0.0):
+    """Строки результатов по точкам за один проход общего DAG выражений"""
+    program = compile_program(tuple(exprs)).scalar
+    if np is not None and isinstance(points, np.ndarray):
+        points = points.tolist()  # Скаляры NumPy делят на ноль без исключения
+    return [[_clean(value) for value in program(point, t)] for point in points]
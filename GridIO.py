@@ -0,0 +1,123 @@
+import os
+from array import array
+
+from GridEval import np
+
+# Расширения файлов с сырыми float64 без заголовка
+RAW_EXTENSIONS = ('.bin', '.f64', '.raw')
+
+
+def _csv_values(file):
+    # Запасной разбор CSV: числа через запятые и переводы строк, нечисловые поля пропускаются
+    for line in file:
+        for value in line.split(','):
+            try:
+                yield float(value)
+            except ValueError:
+                continue
+
+
+def load_points(path):
+    """Точки X из CSV, .npy или сырого float64 файла; двоичные файлы отображаются в память, а не читаются"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        if np is None:
+            raise ValueError("Для чтения .npy нужен NumPy")
+        points = np.load(path, mmap_mode='r')
+    elif extension in RAW_EXTENSIONS:
+        if np is None:
+            points = array('d')
+            with open(path, 'rb') as file:
+                points.frombytes(file.read())
+            return points
+        points = np.memmap(path, dtype=np.float64, mode='r')
+    else:
+        if np is None:
+            with open(path, 'r') as file:
+                return array('d', _csv_values(file))
+        try:
+            points = np.loadtxt(path, delimiter=',', dtype=np.float64, ndmin=2)
+        except ValueError:
+            with open(path, 'r') as file:
+                points = np.fromiter(_csv_values(file), dtype=np.float64)
+
+    points = points.reshape(-1)
+    if points.dtype != np.float64:
+        points = points.astype(np.float64)
+    if len(points) == 0:
+        raise ValueError("В файле нет точек")
+    return points
+
+
+EXPORT_CHUNK = 65536  # Строк результатов на один кусок записи
+
+
+def _export_csv(file, points, store, names, chunk, report):
+    file.write(",".join(["x"] + [name.replace(",", ";") for name in names]) + "\n")
+    for start in range(0, len(store), chunk):
+        end = min(start + chunk, len(store))
+        xs = points[start:end]
+        xs = xs.tolist() if hasattr(xs, 'tolist') else xs
+        # Неопределённые значения - пустые поля
+        file.write("".join(",".join([repr(float(x))] + ["" if v is None else repr(v) for v in row]) + "\n"
+                           for x, row in zip(xs, store.window(start, end))))
+        if not report(end):
+            return
+
+
+def _export_binary(file, points, store, chunk, report):
+    # Построчно: x и значения функций подряд в float64, NaN вместо неопределённых
+    width = store.series_count + 1
+    for start in range(0, len(store), chunk):
+        end = min(start + chunk, len(store))
+        if np is not None:
+            block = np.empty((end - start, width))
+            block[:, 0] = points[start:end]
+            block[:, 1:] = store.values[:, start:end].T
+            file.write(block.tobytes())
+        else:
+            block = array('d')
+            for x, row in zip(points[start:end], store.window(start, end)):
+                block.append(x)
+                block.extend(float('nan') if v is None else v for v in row)
+            file.write(block.tobytes())
+        if not report(end):
+            return
+
+
+def export_results(path, points, store, names, progress=None, cancelled=None, chunk=EXPORT_CHUNK):
+    """Потоково пишет точки и результаты (ResultStore) в CSV, .npy или сырой float64 файл.
+
+    progress(записано, всего) вызывается после каждого куска; если cancelled() вернёт True,
+    запись прекращается, недописанный файл удаляется, и возвращается False.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    total = len(store)
+
+    def report(done):
+        if progress is not None:
+            progress(done, total)
+        return cancelled is None or not cancelled()
+
+    try:
+        if extension == '.npy':
+            if np is None:
+                raise ValueError("Для записи .npy нужен NumPy")
+            with open(path, 'wb') as file:
+                header = {'descr': '<f8', 'fortran_order': False, 'shape': (total, store.series_count + 1)}
+                np.lib.format.write_array_header_1_0(file, header)
+                _export_binary(file, points, store, chunk, report)
+        elif extension in RAW_EXTENSIONS:
+            with open(path, 'wb') as file:
+                _export_binary(file, points, store, chunk, report)
+        else:
+            with open(path, 'w', newline='') as file:
+                _export_csv(file, points, store, names, chunk, report)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    if cancelled is not None and cancelled():
+        os.remove(path)
+        return False
+    return True
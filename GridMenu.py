@@ -1,12 +1,87 @@
-from PySide6.QtWidgets import (QWidget, QVBoxLayout, QLineEdit, QLabel, QPushButton)
-from PySide6.QtCore import Qt, Signal
-import math
+from PySide6.QtWidgets import (QWidget, QVBoxLayout, QLineEdit, QLabel, QPushButton, QFileDialog, QMessageBox,
+                               QTableView, QHeaderView, QCheckBox, QProgressBar)
+from PySide6.QtCore import Qt, Signal, QAbstractTableModel, QModelIndex
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from Grid import format_value
+from GridIO import export_results
+from GridParser import parse_value
+
+class LegendModel(QAbstractTableModel):
+    """Легенда как таблица: строки - функции, столбцы - точки; значения читаются из кэша Grid по запросу"""
+
+    def __init__(self, grid):
+        super().__init__()
+        self.grid = grid
+        # Размеры, о которых уже знает представление; данные при этом берутся из Grid лениво
+        self._rows = len(grid.functions)
+        self._columns = len(grid.points)
+        grid.resultsChanged.connect(self.pointsRangeChanged)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._rows
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._columns
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        results = self.grid.readyResults()
+        if results is None:
+            return "…"  # Ещё считается в фоне
+        if index.column() >= len(results) or index.row() >= results.series_count:
+            return "*"
+        return format_value(results.value(index.column(), index.row()))
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal:
+            if role == Qt.DisplayRole and section < len(self.grid.points):
+                return format_value(self.grid.points[section])
+            return None
+        if section >= len(self.grid.functions):
+            return None
+        func = self.grid.functions[section]
+        if role == Qt.DisplayRole:
+            return func.func
+        if role == Qt.DecorationRole:
+            return func.color
+        return None
+
+    def reset(self):
+        self.beginResetModel()
+        self._rows = len(self.grid.functions)
+        self._columns = len(self.grid.points)
+        self.endResetModel()
+
+    def pointsRangeChanged(self, start, old_end, new_end):
+        # Точки [start, old_end) заменены на [start, new_end); start < 0 - поменялось всё
+        if start < 0 or self._rows != len(self.grid.functions):
+            self.reset()
+            return
+        removed = old_end - start
+        inserted = new_end - start
+        common = min(removed, inserted)
+        if inserted > removed:
+            self.beginInsertColumns(QModelIndex(), start + common, start + inserted - 1)
+            self._columns += inserted - removed
+            self.endInsertColumns()
+        elif removed > inserted:
+            self.beginRemoveColumns(QModelIndex(), start + common, start + removed - 1)
+            self._columns -= removed - inserted
+            self.endRemoveColumns()
+        if common and self._rows:
+            self.dataChanged.emit(self.index(0, start), self.index(self._rows - 1, start + common - 1))
+            self.headerDataChanged.emit(Qt.Horizontal, start, start + common - 1)
+
 
 class GridMenu(QWidget):
     stepYChanged = Signal(float)
     pointsChanged = Signal(str)
     refreshRequested = Signal()
+    _exportProgress = Signal(int)  # Проценты, из потока экспорта
+    _exportFinished = Signal(str)  # Пустая строка - успех, иначе текст ошибки
 
     def __init__(self, grid):
         super().__init__()
@@ -21,6 +96,25 @@ class GridMenu(QWidget):
         self.points_input.textChanged.connect(self.emit_points)
         self.layout.addWidget(self.points_input)
 
+        self.load_button = QPushButton("Загрузить точки из файла")
+        self.load_button.clicked.connect(self.load_points)
+        self.layout.addWidget(self.load_button)
+
+        self.points_file_label = QLabel()
+        self.layout.addWidget(self.points_file_label)
+
+        self.adaptive_checkbox = QCheckBox("Адаптивное уточнение")
+        self.adaptive_checkbox.toggled.connect(self.grid.setAdaptive)
+        self.layout.addWidget(self.adaptive_checkbox)
+
+        self.animation_checkbox = QCheckBox("Анимация по времени t")
+        self.animation_checkbox.toggled.connect(self.toggle_animation)
+        self.layout.addWidget(self.animation_checkbox)
+
+        self.animation_label = QLabel()
+        self.grid.animationFps.connect(self.show_animation_fps)
+        self.layout.addWidget(self.animation_label)
+
         step_label = QLabel("Шаг сетки по Y:")
         self.layout.addWidget(step_label)
 
@@ -35,48 +129,131 @@ class GridMenu(QWidget):
         legend_label = QLabel("Легенда:")
         self.layout.addWidget(legend_label)
 
-        self.legend_text = QLabel()
-        self.legend_text.setWordWrap(True)
-        self.layout.addWidget(self.legend_text)
+        # Таблица форматирует только видимые ячейки, сколько бы ни было точек и функций
+        self.legend_model = LegendModel(self.grid)
+        self.legend_view = QTableView()
+        self.legend_view.setModel(self.legend_model)
+        self.legend_view.horizontalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.legend_view.horizontalHeader().setDefaultSectionSize(50)
+        self.legend_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.layout.addWidget(self.legend_view)
 
-        self.setLayout(self.layout)
-        self.updateLegend()
+        self.export_button = QPushButton("Экспорт результатов")
+        self.export_button.clicked.connect(self.export_results)
+        self.layout.addWidget(self.export_button)
 
-    def refresh_functions(self):
-        self.refreshRequested.emit()
-        self.updateLegend()
+        self.export_progress = QProgressBar()
+        self.export_progress.setRange(0, 100)
+        self.export_progress.hide()
+        self.layout.addWidget(self.export_progress)
+        self._exportProgress.connect(self.export_progress.setValue)
+        self._exportFinished.connect(self.export_finished)
+        self._export_executor = None  # Один фоновый поток на экспорт, создаётся по первому требованию
+        self._export_cancel = None
 
-    def updateLegend(self):
-        if not hasattr(self.grid, 'points') or not hasattr(self.grid, 'functions'):
+        self.profile_checkbox = QCheckBox("Время отрисовки")
+        self.profile_checkbox.toggled.connect(self.toggle_profiler)
+        self.layout.addWidget(self.profile_checkbox)
+
+        self.profile_button = QPushButton("Сохранить замеры")
+        self.profile_button.clicked.connect(self.save_profile)
+        self.layout.addWidget(self.profile_button)
+
+        self.setLayout(self.layout)
+
+    def export_results(self):
+        if self._export_cancel is not None:
+            self._export_cancel.set()  # Повторное нажатие во время экспорта - отмена
+            return
+        if self.grid.readyResults() is None:
+            QMessageBox.information(self, "Экспорт результатов", "Результаты ещё вычисляются")
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Экспорт результатов", "results.csv",
+                                              "CSV (*.csv);;NumPy (*.npy);;float64 (*.f64 *.bin *.raw)")
+        if not path:
             return
+        # Снимок: хранилище результатов не меняется на месте, новые вычисления создают новое
+        points = self.grid.points
+        store = self.grid.getResults()
+        names = [func.label for func in self.grid.functions]
+        cancel = threading.Event()
+        self._export_cancel = cancel
 
-        results = self.grid.calculate_functions()
-        legendLines = []
+        def progress(done, total):
+            self._exportProgress.emit(100 * done // total if total else 100)
 
-        for func in self.grid.functions:
-            values = []
-            for i, point in enumerate(self.grid.points):
-                if i < len(results) and len(results[i]) > self.grid.functions.index(func):
-                    val = results[i][self.grid.functions.index(func)]
-                    values.append(f"{format_value(val)}" if val is not None else "*")
-                else:
-                    values.append("*")
+        def run():
+            try:
+                export_results(path, points, store, names, progress, cancel.is_set)
+            except Exception as e:
+                self._exportFinished.emit(str(e) or type(e).__name__)
+            else:
+                self._exportFinished.emit("")
 
-            color = func["color"]
-            legendLines.append(
-                f"<span style='color: {color.name()}'>■</span> "
-                f"{func['func']}: {', '.join(values)}"
-            )
+        if self._export_executor is None:
+            self._export_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="grid-export")
+        self.export_progress.setValue(0)
+        self.export_progress.show()
+        self.export_button.setText("Отменить экспорт")
+        self._export_executor.submit(run)
 
-        self.legend_text.setText("<br>".join(legendLines))
+    def export_finished(self, error):
+        self._export_cancel = None
+        self.export_progress.hide()
+        self.export_button.setText("Экспорт результатов")
+        if error:
+            QMessageBox.warning(self, "Ошибка экспорта", f"Не удалось сохранить результаты: {error}")
+
+    def toggle_animation(self, enabled):
+        self.grid.setAnimated(enabled)
+        if not enabled:
+            self.animation_label.clear()
+
+    def show_animation_fps(self, achieved, target):
+        self.animation_label.setText(f"Кадров в секунду: {achieved:.0f} из {target:.0f}")
+
+    def toggle_profiler(self, enabled):
+        self.grid.profiler.setEnabled(enabled)
+        self.grid.update()
+
+    def save_profile(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Сохранить замеры", "profile.json", "JSON (*.json);;CSV (*.csv)")
+        if not path:
+            return
+        try:
+            if path.lower().endswith(".csv"):
+                self.grid.profiler.dump_csv(path)
+            else:
+                self.grid.profiler.dump_json(path)
+        except OSError as e:
+            QMessageBox.warning(self, "Ошибка сохранения", f"Не удалось сохранить замеры: {e}")
+
+    def refresh_functions(self):
+        self.refreshRequested.emit()
+        self.updateLegend()
+
+    def updateLegend(self):
+        self.legend_model.reset()
 
     def emit_points(self, text):
+        self.points_file_label.clear()
         self.pointsChanged.emit(text)
 
-    def emit_step(self, text):
+    def load_points(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Загрузить точки", "",
+                                              "Точки (*.csv *.txt *.npy *.bin *.f64 *.raw);;Все файлы (*)")
+        if not path:
+            return
         try:
-            step = text.replace('pi', str(math.pi)).replace('e', str(math.e))
-            self.stepYChanged.emit(float(eval(step)))
-        except:
-            if text:
-                self.stepYChanged.emit(1)
\ No newline at end of file
+            self.grid.loadPoints(path)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Ошибка загрузки", f"Не удалось загрузить точки: {e}")
+            return
+        self.points_file_label.setText(f"Из файла: {os.path.basename(path)}")
+
+    def emit_step(self, text):
+        step = parse_value(text.strip())
+        if step is not None:
+            self.stepYChanged.emit(step)
+        elif text:
+            self.stepYChanged.emit(1)
\ No newline at end of file
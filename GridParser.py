@@ -0,0 +1,278 @@
+import math
+import re
+from array import array
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Сколько разобранных токенов держим в кэше
+TOKEN_CACHE_SIZE = 1 << 17
+# Больше точек один диапазон не порождает: такой токен считается ошибочным
+MAX_RANGE_POINTS = 10_000_000
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+      | (?P<name>[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)?)
+      | (?P<op>\*\*|//|[-+*/%(),])
+    )""", re.VERBOSE)
+
+CONSTANTS = {'pi': math.pi, 'e': math.e, 'tau': math.tau}
+
+FUNCTIONS = {
+    'sin': math.sin, 'cos': math.cos, 'tan': math.tan, 'asin': math.asin, 'acos': math.acos, 'atan': math.atan,
+    'atan2': math.atan2, 'sinh': math.sinh, 'cosh': math.cosh, 'tanh': math.tanh, 'exp': math.exp,
+    'log': math.log, 'log10': math.log10, 'log2': math.log2, 'sqrt': math.sqrt, 'abs': abs, 'fabs': math.fabs,
+    'floor': math.floor, 'ceil': math.ceil, 'hypot': math.hypot, 'radians': math.radians,
+    'degrees': math.degrees, 'pow': math.pow
+}
+
+
+class ParseError(ValueError):
+    pass
+
+
+def split_points(text):
+    """Токены списка точек: запятые внутри скобок (аргументы функций) не разделяют точки"""
+    if '(' not in text:
+        parts = text.split(',')
+    else:
+        parts = []
+        depth = 0
+        start = 0
+        for match in re.finditer(r"[(),]", text):
+            char = match.group()
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth = max(0, depth - 1)
+            elif depth == 0:
+                parts.append(text[start:match.start()])
+                start = match.end()
+        parts.append(text[start:])
+    return [part.strip() for part in parts if part.strip()]
+
+
+def _tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN_RE.match(text, pos)
+        if match is None or match.end() == pos:
+            raise ParseError(f"Непонятный символ в позиции {pos}: {text[pos:pos + 10]!r}")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    # Рекурсивный спуск с приоритетами как в Python: унарный минус слабее **, ** правоассоциативна
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        kind, text = self.peek()
+        if kind is None or (value is not None and text != value):
+            raise ParseError(f"Ожидалось {value or 'выражение'}")
+        self.pos += 1
+        return kind, text
+
+    def parse(self):
+        value = self.expr()
+        if self.pos != len(self.tokens):
+            raise ParseError(f"Лишнее в конце: {self.peek()[1]!r}")
+        return value
+
+    def expr(self):
+        value = self.term()
+        while self.peek()[1] in ('+', '-'):
+            if self.take()[1] == '+':
+                value += self.term()
+            else:
+                value -= self.term()
+        return value
+
+    def term(self):
+        value = self.unary()
+        while self.peek()[1] in ('*', '/', '//', '%'):
+            op = self.take()[1]
+            right = self.unary()
+            if op == '*':
+                value *= right
+            elif op == '/':
+                value /= right
+            elif op == '//':
+                value //= right
+            else:
+                value %= right
+        return value
+
+    def unary(self):
+        if self.peek()[1] == '-':
+            self.take()
+            return -self.unary()
+        if self.peek()[1] == '+':
+            self.take()
+            return self.unary()
+        return self.power()
+
+    def power(self):
+        value = self.atom()
+        if self.peek()[1] == '**':
+            self.take()
+            value = value ** self.unary()  # float ** float переполняется с ошибкой, а не зависает
+        return value
+
+    def atom(self):
+        kind, text = self.take()
+        if kind == 'number':
+            return float(text)
+        if text == '(':
+            value = self.expr()
+            self.take(')')
+            return value
+        if kind == 'name':
+            name = text[5:] if text.startswith('math.') else text
+            if name in CONSTANTS:
+                return CONSTANTS[name]
+            if name in FUNCTIONS:
+                return FUNCTIONS[name](*self.arguments())
+            raise ParseError(f"Неизвестное имя {text!r}")
+        raise ParseError(f"Неожиданный символ {text!r}")
+
+    def arguments(self):
+        self.take('(')
+        args = [self.expr()]
+        while self.peek()[1] == ',':
+            self.take()
+            args.append(self.expr())
+        self.take(')')
+        return args
+
+
+def evaluate_expression(text):
+    """Значение константного выражения (числа, pi, e, арифметика, функции math); ParseError если не разобрать"""
+    try:
+        value = _Parser(_tokenize(text)).parse()
+    except (ArithmeticError, TypeError) as e:
+        raise ParseError(str(e))
+    except ValueError as e:  # Ошибки области определения math, например sqrt(-1)
+        raise ParseError(str(e))
+    except RecursionError:  # Тысячи вложенных скобок или унарных минусов
+        raise ParseError("Слишком глубокая вложенность")
+    if isinstance(value, complex):
+        raise ParseError("Комплексное значение")
+    return float(value)
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def parse_value(token):
+    """Значение одного токена точки или None; каждое выражение сворачивается один раз и кэшируется"""
+    try:
+        value = float(token)  # Быстрый путь для обычных чисел, включая 1e-3
+    except ValueError:
+        try:
+            value = evaluate_expression(token)
+        except ParseError:
+            return None
+    return value if math.isfinite(value) else None
+
+
+def _range_count(start, stop, step):
+    # Число точек start, start+step, ... не дальше stop включительно
+    if step == 0 or (stop - start) * step < 0:
+        return 0
+    return int(math.floor((stop - start) / step + 1e-9)) + 1
+
+
+@lru_cache(maxsize=1024)
+def parse_range(token):
+    """(start, step, count) для диапазона a:b[:step] или linspace(a, b, n); None если токен не диапазон"""
+    if ':' in token:
+        parts = [parse_value(part.strip()) for part in token.split(':')]
+        if len(parts) not in (2, 3) or None in parts:
+            return None
+        start, stop = parts[0], parts[1]
+        step = parts[2] if len(parts) == 3 else 1.0
+        count = _range_count(start, stop, step)
+    elif token.startswith('linspace(') and token.endswith(')'):
+        parts = [parse_value(part) for part in split_points(token[len('linspace('):-1])]
+        if len(parts) != 3 or None in parts or parts[2] != int(parts[2]) or parts[2] < 1:
+            return None
+        start, stop, count = parts[0], parts[1], int(parts[2])
+        step = (stop - start) / (count - 1) if count > 1 else 0.0
+    else:
+        return None
+    if count < 1 or count > MAX_RANGE_POINTS:
+        return None
+    return start, step, count
+
+
+def _range_values(start, step, count):
+    # Значения start + k * step одним массивом float64, без списка чисел-объектов
+    if np is not None:
+        values = np.arange(count, dtype=np.float64)
+        values *= step
+        values += start
+        return values
+    return array('d', (start + k * step for k in range(count)))
+
+
+def parse_point_specs(text):
+    """Разбор строки точек без разворачивания диапазонов: числа и тройки (start, step, count) по порядку"""
+    specs = []
+    for token in split_points(text):
+        spec = parse_range(token)
+        if spec is not None:
+            specs.append(spec)
+            continue
+        value = parse_value(token)
+        if value is not None:
+            specs.append(value)
+    return specs
+
+
+def count_points(specs):
+    # Сколько точек даст expand_points, без построения массивов
+    return sum(spec[2] if isinstance(spec, (tuple, list)) else 1 for spec in specs)
+
+
+def expand_points(specs):
+    """Значения точек по разбору parse_point_specs.
+
+    Если среди них есть диапазоны, результат - массив float64 (как у load_points), иначе список.
+    """
+    pieces = []
+    values = []
+    for spec in specs:
+        if isinstance(spec, (tuple, list)):
+            if values:
+                pieces.append(values)
+                values = []
+            pieces.append(_range_values(*spec))
+        else:
+            values.append(spec)
+    if not pieces:
+        return values
+    if values:
+        pieces.append(values)
+    if np is not None:
+        return pieces[0] if len(pieces) == 1 else np.concatenate(pieces)
+    points = array('d')
+    for piece in pieces:
+        points.extend(piece)
+    return points
+
+
+def parse_points(text):
+    """Все значения точек из строки через запятую; неразборчивые токены пропускаются"""
+    return expand_points(parse_point_specs(text))
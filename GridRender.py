@@ -0,0 +1,150 @@
+import argparse
+import io
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+_app = None  # Свой QApplication в каждом процессе-рисовальщике
+_sandbox = None  # Песочница для выражений из запросов, одна на процесс-рисовальщик
+MAX_WIDTH = 16384  # Шире картинка не бывает: при большем числе точек шаг между ними уменьшается
+SANDBOX_TIMEOUT = 10  # Бюджет времени на вычисление набора функций из запроса, сек
+
+
+def _init_worker():
+    # Qt поднимается один раз на процесс, без окна и без дисплея
+    global _app
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+    _app = QApplication.instance() or QApplication([])
+
+
+def render_image(functions, points, step_y, height=600, width=None, sandbox=None):
+    """Рисует график Grid с заданными функциями и точками в QImage.
+
+    points - строка точек или уже разобранный parse_point_specs список (диапазоны разворачиваются здесь).
+    """
+    if _app is None:
+        _init_worker()
+    from PySide6.QtGui import QImage
+    from Grid import Grid
+    from GridParser import expand_points
+
+    grid = Grid()
+    if sandbox is not None:
+        grid.setSandbox(sandbox)
+    grid.functions = functions
+    grid.setYStep(step_y)
+    if isinstance(points, str):
+        grid.setPoints(points)
+    else:
+        grid.setPointValues(expand_points(points))
+    natural = grid.sizeHint().width()
+    width = min(width or natural, MAX_WIDTH)
+    if natural > width:
+        # Все точки помещаются в картинку: шаг уменьшается, плотный график рисуется через LOD
+        grid.setPointSpacing((width - grid.border_left - grid.border_right) / len(grid.points))
+    grid.resize(width, height)
+
+    image = QImage(grid.size(), QImage.Format_ARGB32_Premultiplied)
+    image.fill(grid.palette().window().color())
+    grid.render(image)
+    return image
+
+
+def render_chart(functions_path, points, step_y, output, height=600, width=None):
+    """Рисует график Grid в картинку и сохраняет её в PNG, возвращает путь к файлу"""
+    if _app is None:
+        _init_worker()
+    from Grid import Grid
+
+    # Не Grid.getFuncs: пакетная отрисовка не должна молча подставлять функции по умолчанию
+    with open(functions_path, "r") as file:
+        functions = Grid.parseFuncs(file, fallback=False)
+    if not functions:
+        raise ValueError(f"В {functions_path} нет ни одной корректной функции")
+    image = render_image(functions, points, step_y, height, width)
+    if not image.save(output, "PNG"):
+        raise OSError(f"Не удалось сохранить {output}")
+    return output
+
+
+def render_png(functions_text, points, step_y, height=600, width=None):
+    """То же, что render_chart, но функции заданы текстом файла функций, а PNG возвращается байтами.
+
+    Текст приходит из недоверенного источника: выражения проверяются check_expression и вычисляются
+    в песочнице; ExpressionError - если выражение недопустимо или не уложилось в бюджет.
+    """
+    global _sandbox
+    if _app is None:
+        _init_worker()
+    from PySide6.QtCore import QBuffer, QIODevice
+    from Grid import Grid
+    from GridEval import ExpressionError, check_expression, is_failed
+    from GridSandbox import Sandbox
+
+    # Без функций по умолчанию: вместо неразборчивого запроса не должна рисоваться и кэшироваться демо-картинка
+    functions = Grid.parseFuncs(io.StringIO(functions_text), fallback=False)
+    if not functions:
+        raise ExpressionError("Нет ни одной корректной функции")
+    for func in functions:
+        check_expression(func.func)
+    if _sandbox is None:
+        _sandbox = Sandbox(timeout=SANDBOX_TIMEOUT)
+    image = render_image(functions, points, step_y, height, width, _sandbox)
+    failed = [func.func for func in functions if is_failed(func.func)]
+    if failed:
+        raise ExpressionError(f"Превышен бюджет времени или памяти: {', '.join(failed)}")
+    buffer = QBuffer()
+    buffer.open(QIODevice.WriteOnly)
+    if not image.save(buffer, "PNG"):
+        raise OSError("Не удалось закодировать PNG")
+    return bytes(buffer.data())
+
+
+def render_batch(jobs, processes=None):
+    """Рисует задания (functions_path, points, step_y, output, ...) в пуле процессов.
+
+    По мере готовности отдаёт пары (путь, ошибка); ошибка одного задания не останавливает остальные.
+    """
+    context = multiprocessing.get_context("spawn")  # fork небезопасен при загруженном Qt
+    with ProcessPoolExecutor(processes, mp_context=context, initializer=_init_worker) as executor:
+        futures = {executor.submit(render_chart, *job): job[3] for job in jobs}
+        for future in as_completed(futures):
+            yield futures[future], future.exception()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетная отрисовка графиков Grid в PNG без окна")
+    parser.add_argument("-f", "--functions", action="append", required=True,
+                        help="файл функций; можно указать несколько раз")
+    parser.add_argument("-p", "--points", action="append", required=True,
+                        help="точки, например '1, 2, 3' или '0:100:0.5'; можно указать несколько раз")
+    parser.add_argument("-s", "--step", type=float, default=1, help="шаг по Y")
+    parser.add_argument("-o", "--output", default=".", help="папка для PNG")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="число процессов (по умолчанию - все ядра)")
+    parser.add_argument("--width", type=int, default=None, help=f"ширина картинки (по умолчанию - по числу точек, но не больше {MAX_WIDTH})")
+    parser.add_argument("--height", type=int, default=600, help="высота картинки")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output, exist_ok=True)
+    # Каждый файл функций рисуется с каждым набором точек
+    jobs = []
+    for functions_path in args.functions:
+        name = os.path.splitext(os.path.basename(functions_path))[0]
+        for i, points in enumerate(args.points):
+            output = os.path.join(args.output, f"{name}_{i}.png")
+            jobs.append((functions_path, points, args.step, output, args.height, args.width))
+
+    failed = 0
+    for output, error in render_batch(jobs, args.jobs):
+        if error is not None:
+            failed += 1
+            print(f"Ошибка при отрисовке {output}: {error}", file=sys.stderr)
+        else:
+            print(output)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
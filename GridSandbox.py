@@ -0,0 +1,107 @@
+import atexit
+import math
+import multiprocessing
+import threading
+from array import array
+
+from GridEval import np, calculate_matrix, evaluate_program
+from GridStore import ResultStore
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _limit_memory(memory_limit):
+    # Ограничение адресного пространства процесса-вычислителя (только POSIX)
+    if resource is not None and memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+
+def _ready():
+    # Пустой вызов: процесс запущен, модули импортированы - дальше время идёт только на вычисления
+    return True
+
+
+def _evaluate_bytes(exprs, data, t=0.0):
+    # Точки и результат передаются сырыми float64, а не списками чисел: так pickle почти ничего не стоит
+    try:
+        if np is not None:
+            points = np.frombuffer(data, dtype=np.float64)
+            return np.ascontiguousarray(calculate_matrix(exprs, points, t).T).tobytes()
+        points = array('d')
+        points.frombytes(data)
+        rows = evaluate_program(exprs, points, t)
+        return b"".join(array('d', (math.nan if row[j] is None else row[j] for row in rows)).tobytes()
+                        for j in range(len(exprs)))
+    except MemoryError:
+        return False
+
+
+class SandboxError(RuntimeError):
+    """Сбой самой песочницы (запуск процесса, передача данных), а не превышение бюджета выражением"""
+
+
+class Sandbox:
+    """Изолированный процесс-вычислитель с бюджетом времени и памяти на каждый вызов.
+
+    Весь набор функций вычисляется за один вызов общей программой (calculate_matrix / evaluate_program).
+    """
+
+    STARTUP_TIMEOUT = 60  # Запуск процесса (spawn заново импортирует главный модуль с Qt и NumPy), сек
+
+    def __init__(self, timeout=2.0, memory_limit=1024 * 1024 * 1024):
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self._context = multiprocessing.get_context("spawn")  # fork небезопасен при загруженном Qt
+        self._lock = threading.Lock()
+        self._pool = None
+        atexit.register(self.close)
+
+    def _call(self, func, *args):
+        # None если вычисление не уложилось в бюджет; зависший процесс пересоздаётся.
+        # Прочие сбои - SandboxError: выражение в них не виновато
+        with self._lock:
+            try:
+                if self._pool is None:
+                    self._start()
+                result = self._pool.apply_async(func, args).get(self.timeout)
+            except multiprocessing.TimeoutError:
+                self._reset()
+                return None
+            except SandboxError:
+                self._reset()
+                raise
+            except Exception as e:
+                self._reset()
+                raise SandboxError(f"{type(e).__name__}: {e}") from e
+            return result if result is not False else None
+
+    def _start(self):
+        # Холодный старт не входит в бюджет выражения: ждём готовности процесса отдельно
+        self._pool = self._context.Pool(1, initializer=_limit_memory, initargs=(self.memory_limit,))
+        try:
+            self._pool.apply_async(_ready).get(self.STARTUP_TIMEOUT)
+        except multiprocessing.TimeoutError:
+            raise SandboxError("Процесс песочницы не запустился")
+
+    def _reset(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def evaluate(self, exprs, points, t=0.0):
+        """ResultStore значений функций во всех точках (в момент t) или None, если набор превысил бюджет"""
+        if np is not None:
+            data = np.asarray(points, dtype=np.float64).tobytes()
+        else:
+            data = array('d', points).tobytes()
+        result = self._call(_evaluate_bytes, list(exprs), data, t)
+        if result is None:
+            return None
+        return ResultStore.from_bytes(result, len(exprs), len(points))
+
+    def close(self):
+        with self._lock:
+            self._reset()
@@ -0,0 +1,57 @@
+import itertools
+import weakref
+
+from PySide6.QtGui import QBrush, QColor, QPen
+
+# Кисти и перья трёх оттенков цвета функции, считаются один раз на цвет
+_shade_styles = {}
+
+
+def shade_styles(color):
+    key = color.rgba()
+    if key not in _shade_styles:
+        _shade_styles[key] = tuple((QBrush(shade), QPen(shade, 1))
+                                   for shade in (QColor(color), color.darker(120), color.darker(150)))
+    return _shade_styles[key]
+
+
+class Series:
+    """Функция графика: выражение, цвет с готовыми кистями и перьями, постоянный номер"""
+    __slots__ = ("id", "func", "color", "name", "styles", "__weakref__")
+
+    def __init__(self, id, func, color, name=None):
+        self.id = id
+        self.func = func
+        self.color = color
+        self.name = name
+        # (кисть, перо) основного цвета, darker(120) и darker(150); в порядке рисования граней - с конца
+        self.styles = shade_styles(color)
+
+    @property
+    def label(self):
+        return self.name or self.func
+
+    def __repr__(self):
+        return f"Series({self.id}, {self.func!r}, {self.color.name()})"
+
+
+class SeriesRegistry:
+    """Одна серия на (выражение, цвет, имя), пока она кому-то нужна; номера не переиспользуются"""
+    __slots__ = ("_series", "_ids")
+
+    def __init__(self):
+        self._series = weakref.WeakValueDictionary()
+        self._ids = itertools.count()
+
+    def get(self, func, color, name=None):
+        color = QColor(color)
+        key = (func, color.rgba(), name)
+        series = self._series.get(key)
+        if series is None:
+            series = Series(next(self._ids), func, color, name)
+            self._series[key] = series
+        return series
+
+
+# Общий реестр: getFuncs, setFunctions и функции по умолчанию выдают серии отсюда
+registry = SeriesRegistry()
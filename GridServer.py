@@ -0,0 +1,295 @@
+import argparse
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from GridEval import ExpressionError
+from GridParser import count_points, parse_point_specs, parse_value
+from GridRender import MAX_WIDTH, _init_worker, render_png
+
+HOST = "127.0.0.1"  # Только локальная машина
+PORT = 8765
+MAX_BODY = 1024 * 1024
+MAX_HEIGHT = 4096
+MAX_POINTS = 1_000_000  # Больше точек в одном запросе не рисуем: проверяется до построения массивов
+RENDER_TIMEOUT = 60
+CACHE_SIZE = 256 * 1024 * 1024  # Сколько байт PNG держим в кэше, старые вытесняются
+
+
+class RequestError(ValueError):
+    pass
+
+
+def _number(value, name):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise RequestError(f"{name}: ожидалось число")
+    if isinstance(value, str):
+        number = parse_value(value)  # None, если не разобрать или значение не конечно
+    else:
+        try:
+            number = float(value)
+        except OverflowError:
+            number = None
+    if number is None or not math.isfinite(number):
+        raise RequestError(f"{name}: ожидалось конечное число")
+    return number
+
+
+def _size(value, name, limit):
+    if value is None:
+        return None
+    if not isinstance(value, int) or isinstance(value, bool) or not 1 <= value <= limit:
+        raise RequestError(f"{name}: ожидалось целое от 1 до {limit}")
+    return value
+
+
+def normalize_request(data):
+    """Проверяет запрос и приводит его к каноническому виду (functions, points, step, height, width).
+
+    points - разбор parse_point_specs: диапазоны остаются тройками (start, step, count) до процесса-рисовальщика.
+    """
+    if not isinstance(data, dict):
+        raise RequestError("Ожидался JSON-объект")
+    functions = data.get("functions", "")
+    if isinstance(functions, list):
+        functions = ", ".join(str(func) for func in functions)  # ["4/(1-x) red", "x**2 green"]
+    if not isinstance(functions, str):
+        raise RequestError("functions: ожидалась строка или список строк")
+    points = data.get("points", "1, 2, 3")
+    if isinstance(points, list):
+        points = ", ".join(str(point) for point in points)
+    if not isinstance(points, str):
+        raise RequestError("points: ожидалась строка или список")
+    # Диапазоны не разворачиваются: массивы строит процесс-рисовальщик, когда запрос уже проверен
+    points = parse_point_specs(points)
+    count = count_points(points)
+    if not count:
+        raise RequestError("points: нет ни одной разборчивой точки")
+    if count > MAX_POINTS:
+        raise RequestError(f"points: больше {MAX_POINTS} точек")
+    step = _number(data.get("step", 1), "step")
+    height = _size(data.get("height", 600), "height", MAX_HEIGHT)
+    width = _size(data.get("width"), "width", MAX_WIDTH)
+    return functions, points, step, height, width
+
+
+def cache_key(request):
+    # Адрес картинки в кэше - хэш канонического представления всех входных данных
+    return hashlib.sha256(json.dumps(request, ensure_ascii=False).encode()).hexdigest()
+
+
+class RenderCache:
+    """Кэш PNG на диске по хэшу входных данных; одинаковые запросы в работе рисуются один раз.
+
+    Папка кэша доступна только владельцу; при переполнении вытесняются давно не читанные картинки.
+    """
+
+    def __init__(self, executor, directory=None, max_pending=64, max_bytes=CACHE_SIZE):
+        self.executor = executor
+        self._temporary = directory is None
+        if self._temporary:
+            self.directory = tempfile.mkdtemp(prefix="grid-render-cache-")
+        else:
+            self.directory = directory
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            self._check_directory()
+        self.max_pending = max_pending
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()  # Колбэк готовой future может сработать прямо под блокировкой
+        self._pending = {}  # Ключ -> future отрисовки, которая уже идёт
+        self._entries = OrderedDict()  # Ключ -> размер PNG, от давно не читанных к свежим
+        self._size = 0
+        self._load_entries()
+
+    def _check_directory(self):
+        # Заранее созданную чужую или общедоступную папку не используем: в неё могли подложить картинки
+        info = os.stat(self.directory)
+        if hasattr(os, "getuid") and info.st_uid != os.getuid():
+            raise PermissionError(f"Папка кэша {self.directory} принадлежит другому пользователю")
+        if info.st_mode & 0o077:
+            raise PermissionError(f"Папка кэша {self.directory} доступна другим пользователям")
+
+    def _load_entries(self):
+        # Картинки, оставшиеся с прошлого запуска, - от старых к новым
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                os.unlink(path)
+            elif name.endswith(".png"):
+                info = os.stat(path)
+                files.append((info.st_mtime, name[:-len(".png")], info.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._size += size
+        with self._lock:
+            self._evict()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".png")
+
+    def get(self, request):
+        """Возвращает (png, попадание в кэш); None вместо png, если очередь переполнена"""
+        key = cache_key(request)
+        with self._lock:
+            hit = key in self._entries
+            if hit:
+                self._entries.move_to_end(key)
+        if hit:
+            try:
+                with open(self.path(key), "rb") as file:
+                    return file.read(), True
+            except FileNotFoundError:
+                pass  # Вытеснена между проверкой и чтением - рисуем заново
+
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                if len(self._pending) >= self.max_pending:
+                    return None, False
+                future = self.executor.submit(render_png, *request)
+                self._pending[key] = future
+                future.add_done_callback(lambda done: self._store(key, done))
+        return future.result(RENDER_TIMEOUT), False
+
+    def _store(self, key, future):
+        try:
+            if future.exception() is None:
+                png = future.result()
+                # Пишем во временный файл и переименовываем, чтобы читатели не видели недописанный PNG
+                fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+                with os.fdopen(fd, "wb") as file:
+                    file.write(png)
+                os.replace(tmp, self.path(key))
+                with self._lock:
+                    self._size += len(png) - self._entries.pop(key, 0)
+                    self._entries[key] = len(png)
+                    self._evict()
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _evict(self):
+        # Под блокировкой: удаляем давно не читанные картинки, пока кэш больше max_bytes
+        while self._size > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            try:
+                os.unlink(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        # Временная папка, созданная самим кэшем, удаляется вместе с содержимым
+        if self._temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+    cache = None  # RenderCache, задаётся в make_server
+
+    def _allowed_host(self):
+        # Защита от DNS rebinding: страница с чужого домена, указывающего на 127.0.0.1, шлёт свой Host
+        port = self.server.server_address[1]
+        return self.headers.get("Host") in (f"{HOST}:{port}", f"localhost:{port}")
+
+    def do_POST(self):
+        if not self._allowed_host():
+            self._send(403, "Недопустимый Host".encode(), "text/plain; charset=utf-8")
+            return
+        if self.path != "/render":
+            self._send(404, b"Not found", "text/plain; charset=utf-8")
+            return
+        # Только application/json: такой запрос браузер не отправит с чужой страницы без CORS-проверки,
+        # а на OPTIONS сервер не отвечает разрешением
+        if self.headers.get_content_type() != "application/json":
+            self._send(415, "Ожидался Content-Type: application/json".encode(), "text/plain; charset=utf-8")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length > MAX_BODY:
+                raise RequestError("Слишком большой запрос")
+            request = normalize_request(json.loads(self.rfile.read(length) or b"{}"))
+        except (ValueError, RecursionError) as e:  # JSONDecodeError и RequestError - тоже ValueError
+            self._send(400, str(e).encode(), "text/plain; charset=utf-8")
+            return
+
+        try:
+            png, hit = self.cache.get(request)
+        except ExpressionError as e:
+            self._send(400, str(e).encode(), "text/plain; charset=utf-8")
+            return
+        except Exception as e:
+            self._send(500, f"Ошибка при отрисовке: {e}".encode(), "text/plain; charset=utf-8")
+            return
+        if png is None:
+            self._send(503, "Очередь отрисовки переполнена".encode(), "text/plain; charset=utf-8")
+            return
+        self._send(200, png, "image/png", {"X-Cache": "hit" if hit else "miss"})
+
+    def do_GET(self):
+        if not self._allowed_host():
+            self._send(403, "Недопустимый Host".encode(), "text/plain; charset=utf-8")
+        elif self.path == "/health":
+            self._send(200, b"ok", "text/plain; charset=utf-8")
+        else:
+            self._send(404, b"Not found", "text/plain; charset=utf-8")
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Не засоряем вывод при нагрузочном тестировании
+
+
+def make_server(host=HOST, port=PORT, processes=None, cache_dir=None, max_pending=64, cache_size=CACHE_SIZE):
+    """HTTP-сервер отрисовки с пулом процессов Qt и кэшем картинок; запускается через serve_forever()"""
+    context = multiprocessing.get_context("spawn")  # fork небезопасен при загруженном Qt
+    executor = ProcessPoolExecutor(processes, mp_context=context, initializer=_init_worker)
+    cache = RenderCache(executor, cache_dir, max_pending, cache_size)
+    handler = type("Handler", (RenderHandler,), {"cache": cache})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.executor = executor
+    server.cache = cache
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальный HTTP-сервис отрисовки графиков Grid (POST /render)")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="число процессов (по умолчанию - все ядра)")
+    parser.add_argument("--cache", default=None, help="папка кэша картинок (по умолчанию - временная, только для владельца)")
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE // (1024 * 1024), help="размер кэша картинок, МБ")
+    parser.add_argument("--max-pending", type=int, default=64, help="сколько разных картинок рисовать одновременно")
+    args = parser.parse_args(argv)
+
+    server = make_server(HOST, args.port, args.jobs, args.cache, args.max_pending, args.cache_size * 1024 * 1024)
+    print(f"http://{HOST}:{args.port}/render")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.executor.shutdown(cancel_futures=True)
+        server.cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+import math
+import tempfile
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Результаты больше этого размера (значения и маска) держатся в файле, отображённом в память
+SPILL_BYTES = 256 * 1024 * 1024
+
+
+def _allocate(shape, dtype):
+    count = shape[0] * shape[1]
+    if SPILL_BYTES is not None and count * np.dtype(dtype).itemsize > SPILL_BYTES:
+        # Временный файл удаляется сразу, отображение живёт, пока на массив есть ссылки
+        return np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode='w+', shape=shape)
+    return np.empty(shape, dtype=dtype)
+
+
+def _python_sums(columns, valid, count):
+    positive = array('d', bytes(8 * count))
+    negative = array('d', bytes(8 * count))
+    for column, mask in zip(columns, valid):
+        for i in range(count):
+            if mask[i]:
+                value = column[i]
+                if value > 0:
+                    positive[i] += value
+                else:
+                    negative[i] += value
+    return positive, negative
+
+
+class ResultStore:
+    """Результаты по столбцам: float64 на функцию, маска определённых значений и суммы стопок в каждой точке.
+
+    С NumPy values и valid - массивы (функции x точки), без него - списки array('d') и bytearray.
+    Неопределённые значения хранятся как NaN и отмечены нулём в маске.
+    """
+
+    def __init__(self, values, valid, count, positive=None, negative=None):
+        self.values = values
+        self.valid = valid
+        self.count = count  # Число точек
+        if positive is None:
+            positive, negative = self._sums()
+        self.positive = positive
+        self.negative = negative
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        """Из матрицы NumPy точки x функции с NaN вместо неопределённых значений"""
+        values = matrix.T
+        if not values.flags.c_contiguous or (SPILL_BYTES is not None and values.nbytes > SPILL_BYTES):
+            values = _allocate(values.shape, np.float64)
+            values[...] = matrix.T
+        valid = _allocate(values.shape, np.bool_)
+        np.isnan(values, out=valid)
+        np.logical_not(valid, out=valid)
+        return cls(values, valid, matrix.shape[0])
+
+    @classmethod
+    def from_columns(cls, columns, count):
+        """Из списков значений по функциям, None - неопределённое значение"""
+        if np is not None:
+            matrix = np.empty((count, len(columns)))
+            for j, column in enumerate(columns):
+                matrix[:, j] = np.array(column, dtype=np.float64)  # None превращается в NaN
+            return cls.from_matrix(matrix)
+        values = [array('d', (math.nan if v is None else v for v in column)) for column in columns]
+        valid = [bytearray(v is not None for v in column) for column in columns]
+        return cls(values, valid, count)
+
+    @classmethod
+    def from_rows(cls, rows, series):
+        """Из строк по точкам, как их отдаёт скалярное вычисление"""
+        if np is not None:
+            return cls.from_matrix(np.array(rows, dtype=np.float64).reshape(len(rows), series))
+        return cls.from_columns([[row[j] for row in rows] for j in range(series)], len(rows))
+
+    @classmethod
+    def from_bytes(cls, data, series, count):
+        """Из сырых float64 по функциям подряд (series x count), NaN - неопределённое значение"""
+        if np is not None:
+            values = np.frombuffer(data, dtype=np.float64).reshape(series, count)
+            return cls(values, ~np.isnan(values), count)
+        flat = array('d')
+        flat.frombytes(data)
+        values = [flat[j * count:(j + 1) * count] for j in range(series)]
+        return cls(values, [bytearray(v == v for v in column) for column in values], count)
+
+    @classmethod
+    def empty(cls, series=0, count=0):
+        """series функций без значений в count точках"""
+        if np is not None:
+            return cls(np.full((series, count), np.nan), np.zeros((series, count), dtype=np.bool_), count)
+        return cls([array('d', [math.nan]) * count for _ in range(series)],
+                   [bytearray(count) for _ in range(series)], count)
+
+    @classmethod
+    def concat(cls, parts, series=0):
+        """Склейка по точкам; суммы частей переиспользуются"""
+        parts = [part for part in parts if part.count]
+        if not parts:
+            return cls.empty(series)
+        if len(parts) == 1:
+            return parts[0]
+        count = sum(part.count for part in parts)
+        if np is None:
+            values = [sum((part.values[j] for part in parts), array('d')) for j in range(parts[0].series_count)]
+            valid = [b"".join(part.valid[j] for part in parts) for j in range(parts[0].series_count)]
+            return cls(values, [bytearray(mask) for mask in valid], count,
+                       sum((part.positive for part in parts), array('d')),
+                       sum((part.negative for part in parts), array('d')))
+        shape = (parts[0].series_count, count)
+        values = _allocate(shape, np.float64)
+        valid = _allocate(shape, np.bool_)
+        start = 0
+        for part in parts:
+            values[:, start:start + part.count] = part.values
+            valid[:, start:start + part.count] = part.valid
+            start += part.count
+        return cls(values, valid, count,
+                   np.concatenate([part.positive for part in parts]),
+                   np.concatenate([part.negative for part in parts]))
+
+    @classmethod
+    def stack(cls, sources, count):
+        """Новый набор функций из столбцов других хранилищ: sources - список (хранилище, номер функции)"""
+        if np is None:
+            return cls([source.values[j] for source, j in sources], [source.valid[j] for source, j in sources],
+                       count)
+        shape = (len(sources), count)
+        values = _allocate(shape, np.float64)
+        valid = _allocate(shape, np.bool_)
+        for k, (source, j) in enumerate(sources):
+            values[k] = source.values[j]
+            valid[k] = source.valid[j]
+        return cls(values, valid, count)
+
+    def _sums(self):
+        if np is None:
+            return _python_sums(self.values, self.valid, self.count)
+        # Строки складываются по порядку функций, как в стопке; NaN в nansum не участвует
+        return np.nansum(np.maximum(self.values, 0.0), axis=0), np.nansum(np.minimum(self.values, 0.0), axis=0)
+
+    def slice(self, start, end):
+        """Точки [start, end) без копирования там, где это возможно"""
+        if np is None:
+            return ResultStore([column[start:end] for column in self.values], [mask[start:end] for mask in self.valid],
+                               max(0, min(end, self.count) - start), self.positive[start:end],
+                               self.negative[start:end])
+        return ResultStore(self.values[:, start:end], self.valid[:, start:end], len(self.positive[start:end]),
+                           self.positive[start:end], self.negative[start:end])
+
+    def splice(self, start, end, other):
+        """Точки [start, end) заменены точками other"""
+        return ResultStore.concat([self.slice(0, start), other, self.slice(end, self.count)], self.series_count)
+
+    @property
+    def series_count(self):
+        return len(self.values)
+
+    def __len__(self):
+        return self.count
+
+    def value(self, i, j):
+        """Значение функции j в точке i или None, если оно не определено"""
+        if np is None:
+            return self.values[j][i] if self.valid[j][i] else None
+        return float(self.values[j, i]) if self.valid[j, i] else None
+
+    def window(self, start, end):
+        """Строки [start, end) списками значений с None, для отрисовки видимых столбцов"""
+        if np is None:
+            return [[column[i] if mask[i] else None for column, mask in zip(self.values, self.valid)]
+                    for i in range(start, min(end, self.count))]
+        values = self.values[:, start:end].T.tolist()
+        valid = self.valid[:, start:end].T.tolist()
+        return [[v if ok else None for v, ok in zip(row, mask)] for row, mask in zip(values, valid)]
+
+    def __getitem__(self, i):
+        return self.window(i, i + 1)[0]
+
+    def __iter__(self):
+        for start in range(0, self.count, 4096):
+            yield from self.window(start, start + 4096)
+
+    def extent(self):
+        """Наибольшая сумма положительных и наименьшая сумма отрицательных значений стопки"""
+        if not self.count:
+            return 0, 0
+        if np is None:
+            return max(self.positive), min(self.negative)
+        return float(self.positive.max()), float(self.negative.min())
@@ -1,7 +1,8 @@
 import math
 from PySide6.QtWidgets import QWidget
 from PySide6.QtCore import Qt, QPointF
-from PySide6.QtGui import QPainter, QPen, QWheelEvent, QMouseEvent
+from PySide6.QtGui import QPainter, QPen, QWheelEvent, QMouseEvent, QKeyEvent
+from FrameProfiler import FrameProfiler
 
 class Point3D:
     """Класс для представления точки в 3D пространстве"""
@@ -167,6 +168,7 @@ class Scene3D(QWidget):
         self.last_mouse_pos = None
         self.setMouseTracking(True)
         self.setFocusPolicy(Qt.StrongFocus)
+        self.profiler = FrameProfiler()  # Время этапов отрисовки, F3 включает сводку поверх сцены
 
     def add_letter(self, letter):
         """Добавляет букву в сцену"""
@@ -196,6 +198,14 @@ class Scene3D(QWidget):
         """Обработка отпускания кнопки мыши"""
         self.last_mouse_pos = None
 
+    def keyPressEvent(self, event: QKeyEvent):
+        """F3 включает и выключает профилирование отрисовки"""
+        if event.key() == Qt.Key_F3:
+            self.profiler.setEnabled(not self.profiler.enabled)
+            self.update()
+        else:
+            super().keyPressEvent(event)
+
     def project_point(self, point):
         """Проецирует 3D точку на 2D плоскость с учетом перспективы"""
         # Применяем вращение камеры
@@ -236,16 +246,20 @@ class Scene3D(QWidget):
     def paintEvent(self, event):
         """Отрисовывает сцену"""
         painter = QPainter(self)
-        painter.setRenderHint(QPainter.Antialiasing)
-        painter.fillRect(self.rect(), Qt.black)  # Черный фон
+        with self.profiler.frame():
+            painter.setRenderHint(QPainter.Antialiasing)
+            painter.fillRect(self.rect(), Qt.black)  # Черный фон
 
-        # Отрисовка осей
-        if self.show_axes:
-            self.draw_axes(painter)
+            # Отрисовка осей
+            if self.show_axes:
+                with self.profiler.phase("axes"):
+                    self.draw_axes(painter)
+                self.profiler.count("painter", 6)
 
-        # Отрисовка букв
-        for letter in self.letters:
-            self.draw_letter(painter, letter)
+            # Отрисовка букв
+            for letter in self.letters:
+                self.draw_letter(painter, letter)
+        self.profiler.draw_overlay(painter)
 
     def draw_axes(self, painter):
         """Отрисовывает оси координат"""
@@ -276,14 +290,29 @@ class Scene3D(QWidget):
         pen = QPen(Qt.white, 2)  # Белые линии на черном фоне
         painter.setPen(pen)
 
-        for edge in letter.edges:
-            start = letter.transform_point(edge.start)
-            end = letter.transform_point(edge.end)
+        if not self.profiler.enabled:
+            for edge in letter.edges:
+                start = letter.transform_point(edge.start)
+                end = letter.transform_point(edge.end)
+
+                start_proj = self.project_point(start)
+                end_proj = self.project_point(end)
+
+                painter.drawLine(start_proj, end_proj)
+            return
+
+        # При профилировании три прохода вместо одного, чтобы профайлер видел время каждого этапа отдельно
+        with self.profiler.phase("transform"):
+            edges = [(letter.transform_point(edge.start), letter.transform_point(edge.end))
+                     for edge in letter.edges]
 
-            start_proj = self.project_point(start)
-            end_proj = self.project_point(end)
+        with self.profiler.phase("project"):
+            lines = [(self.project_point(start), self.project_point(end)) for start, end in edges]
 
-            painter.drawLine(start_proj, end_proj)
+        with self.profiler.phase("draw"):
+            for start_proj, end_proj in lines:
+                painter.drawLine(start_proj, end_proj)
+        self.profiler.count("painter", len(lines))
 
     def reset_camera(self):
         """Сбрасывает параметры камеры в положение по умолчанию"""
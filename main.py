@@ -1,6 +1,7 @@
 import sys
-from PySide6.QtWidgets import QApplication, QMainWindow, QHBoxLayout, QWidget
+from PySide6.QtWidgets import QApplication, QMainWindow, QHBoxLayout, QWidget, QScrollArea
 from Grid import Grid
+from GridSandbox import Sandbox
 from GridMenu import GridMenu
 
 
@@ -12,18 +13,25 @@ class MainWindow(QMainWindow):
         mainLay.setContentsMargins(5, 5, 5, 5)
 
         self.grid = Grid()
+        self.grid.setSandbox(Sandbox())  # Одна плохая функция не должна ронять всё приложение
+        self.grid.setAsync(True)  # Вычисления в фоне, чтобы ввод не подвешивал интерфейс
+        self.grid.watchFunctionsFile()  # Функции перечитываются сами, когда файл переписывают
         self.menu = GridMenu(self.grid)
         self.menu.setFixedWidth(300)
 
         self.menu.stepYChanged.connect(self.grid.setYStep)
         self.menu.pointsChanged.connect(self.grid.setPoints)
-        self.grid.pointsProcessed.connect(self.menu.updateLegend)
         self.menu.refreshRequested.connect(self.refresh_functions)
 
         # Обновляем размер окна при изменении точек
         self.grid.pointsProcessed.connect(self.adjustWindowSize)
 
-        mainLay.addWidget(self.grid)
+        # Широкий график прокручивается, а Grid рисует только видимые столбцы
+        self.scroll = QScrollArea()
+        self.scroll.setWidget(self.grid)
+        self.scroll.setWidgetResizable(True)
+
+        mainLay.addWidget(self.scroll)
         mainLay.addWidget(self.menu)
 
         container = QWidget()
@@ -32,13 +40,14 @@ class MainWindow(QMainWindow):
         self.adjustWindowSize()
 
     def refresh_functions(self):
-        self.grid.functions = self.grid.getFuncs()  # Перечитываем функции из файла
-        self.grid.update()  # Перерисовываем графики
+        self.grid.reloadFunctions()  # Перечитываем функции из файла и перерисовываем графики
         self.menu.updateLegend()  # Обновляем легенду
 
     def adjustWindowSize(self):
-        self.resize(self.grid.sizeHint().width(), 600)
-        self.setMinimumSize(self.grid.minimumSizeHint().width() + 350, 400)
+        # Окно растёт вместе с графиком, но не шире экрана: дальше работает прокрутка
+        screen_width = self.screen().availableGeometry().width()
+        self.resize(min(self.grid.sizeHint().width(), screen_width), 600)
+        self.setMinimumSize(min(self.grid.minimumSizeHint().width() + 350, screen_width), 400)
 
 
 if __name__ == "__main__":